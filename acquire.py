@@ -1,10 +1,30 @@
-import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+import numpy as np
 import pandas as pd
-from person_page import PersonPage
+from person_page import PersonPage, to_day, parse_months
+from sparql_client import SparqlClient, default_url
+from mongodb_client import BufferedWriter
+import crawl_ledger
+from metrics import Metrics, NullMetrics
 
-regex_keys = ['revPerMonth', 'averageSizePerMonth']
+# exact dispatch on the predicate local name (the fragment after the last '/' or '#')
+predicate_keys = {'revPerMonth': 'num_rev',
+                  'averageSizePerMonth': 'size_rev',
+                  'uniqueContributorNb': 'unique_contributors',
+                  'birthDate': 'birth_date',
+                  'deathDate': 'death_date'}
 
-other_keys = ['uniqueContributorNb', 'birthDate', 'deathDate', 'jusqu\'auFonction']
+_predicate_kinds = {}       # predicate URI -> kind, the handful of distinct URIs is resolved once
+
+
+def _predicate_kind(uri):
+    kind = _predicate_kinds.get(uri)
+    if kind is None:
+        local = uri[max(uri.rfind('/'), uri.rfind('#')) + 1:]
+        kind = predicate_keys.get(local, 'important_date' if 'Fonction' in local else '')
+        _predicate_kinds[uri] = kind
+    return kind
 
 
 class DataCleaner:
@@ -12,114 +32,266 @@ class DataCleaner:
         self.data = data
         self.person_page = PersonPage(person)
 
-    def _convert_date(self, datestring, month=False):
-        if month:
-            return pd.to_datetime(datestring, format="%m/%Y")
-        else:
-            return pd.to_datetime(datestring, format="%Y")
-
     def _convert_complete_date(self, datestring):
-        try:
-            return pd.to_datetime(datestring.split("+")[0], format="%Y-%m-%d", infer_datetime_format=True)
-        except:
-            return datestring.split("+")[0]
+        return to_day(datestring.split("+")[0])      # NaT when unparseable
 
-    def get_secondary_keys(self):
+    def _extract(self):
+        # single pass: {nodeid: row} into columnar lists, secondary keys collected on the way
+        rows = {}
+        months = []
+        num_rev = []
+        size_rev = []
         for dic in self.data:
+            kind = _predicate_kind(dic['p']['value'])
+            if kind == 'num_rev' or kind == 'size_rev':
+                nodeid = dic['v']['value']
+                row = rows.get(nodeid)
+                if row is None:
+                    row = rows[nodeid] = len(months)
+                    months.append(None)
+                    num_rev.append(0)
+                    size_rev.append(0.0)
+                value_string = dic['v2']['value']
+                if '/' in value_string:         # MM/YYYY
+                    months[row] = value_string
+                elif kind == 'num_rev':
+                    num_rev[row] = int(value_string)
+                else:
+                    size_rev[row] = float(value_string)
+            elif kind == 'unique_contributors':
+                self.person_page.add_unique_contributors(int(dic['v']['value']))
+
             if 'p2' in dic:
-                if re.search('birthDate', dic['p2']['value']):
+                kind = _predicate_kind(dic['p2']['value'])
+                if kind == 'birth_date':
                     self.person_page.add_birth_date(self._convert_complete_date(dic['v2']['value']))
-                if re.search('deathDate', dic['p2']['value']):
+                elif kind == 'death_date':
                     self.person_page.add_death_date(self._convert_complete_date(dic['v2']['value']))
-                if re.search('Fonction', dic['p2']['value']):
+                elif kind == 'important_date':
                     self.person_page.add_important_date(self._convert_complete_date(dic['v2']['value']))
+        return months, num_rev, size_rev
 
-            if re.search('uniqueContributorNb', dic['p']['value']):
-                self.person_page.add_unique_contributors(int(dic['v']['value']))
+    def create_dataframe(self):
+        months, num_rev, size_rev = self._extract()
+        if not months:
+            return
+        # merge the revPerMonth and averageSizePerMonth nodes of the same month
+        codes, uniques = pd.factorize(np.asarray(months, dtype=object))
+        valid = codes >= 0
+        codes = codes[valid]
+        self.person_page.add_series(parse_months(uniques),
+                                    np.bincount(codes, weights=np.asarray(num_rev)[valid], minlength=len(uniques)),
+                                    np.bincount(codes, weights=np.asarray(size_rev)[valid], minlength=len(uniques)))
 
-    def _extract(self):
-        nodeid_dic = {}
-        self.get_secondary_keys()
-        for dic in self.data:       # first, from data to {nodeid: [num, timestamp]}
-            for k, v in dic.items():
-                if re.search('revPerMonth', v['value']):
-                    nodeid = dic['v']['value']
-                    if nodeid not in nodeid_dic:
-                        nodeid_dic[nodeid] = {'num_rev': 0, 'month': 0, 'size_rev': 0}
-                    value_string = dic['v2']['value']
-                    try:
-                        value = int(value_string)
-                        nodeid_dic[nodeid]['num_rev'] = value
-                    except ValueError:
-                        value = self._convert_date(value_string, month=True)
-                        nodeid_dic[nodeid]['month'] = value
-
-                elif re.search('averageSizePerMonth', v['value']):
-                    nodeid = dic['v']['value']
-                    if nodeid not in nodeid_dic:
-                        nodeid_dic[nodeid] = {'num_rev': 0, 'month': 0, 'size_rev': 0}
-                    value_string = dic['v2']['value']
-                    try:
-                        value = float(value_string)
-                        nodeid_dic[nodeid]['size_rev'] = value
-                    except ValueError:
-                        value = self._convert_date(value_string, month=True)
-                        nodeid_dic[nodeid]['month'] = value
-
-        if len(nodeid_dic) == 0:
-            # print("{} page has no information on revPerMonth".format(self.person_page.name))
-            # print("Skipping")
+
+class Harvester:
+    def __init__(self, db, ledger=None, cache=None, url=default_url, workers=8, timeout=60, retries=3,
+                 backoff=2.0, min_length=10, flush_size=200, flush_interval=10.0, metrics=None):
+        self.db = db
+        self.metrics = metrics or NullMetrics()
+        self.writer = BufferedWriter(db, size=flush_size, interval=flush_interval, on_flush=self._inserted,
+                                     metrics=self.metrics)
+        self.ledger = ledger
+        self.cache = cache
+        self.url = url
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.min_length = min_length
+        self.inserted = 0
+        self.insufficient = 0
+        self.failed = 0
+        self._local = threading.local()
+
+    def _client(self):
+        # SPARQLWrapper keeps the query as state, so every worker thread gets its own client
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = SparqlClient(self.url, timeout=self.timeout, retries=self.retries, backoff=self.backoff,
+                                  cache=self.cache, metrics=self.metrics)
+            self._local.client = client
+        return client
+
+    def _fetch(self, person):
+        res = self._client().get_history_per_person(person)
+        if res is None:
             return None
-        assert [re.match('nodeID', k) for k in nodeid_dic]
+        data = res['results']['bindings']  # List of dictionaries
+        with self.metrics.timer('extract'):
+            d = DataCleaner(data, person)
+            d.create_dataframe()
+        return d.person_page
 
-        time_dic = {}           # second, from {nodeid: [num, timestamp, size]} to {timestamp: {num, size}}
-        for _, v in nodeid_dic.items():
-            if v['month'] not in time_dic:
-                time_dic[v['month']] = {'num_rev': 0, 'size_rev': 0}
-            time_dic[v['month']]['num_rev'] += v['num_rev']
-            time_dic[v['month']]['size_rev'] += v['size_rev']
-        return time_dic
+    def _mark(self, person, status, **kwargs):
+        if self.ledger is not None:
+            self.ledger.mark(person, status, **kwargs)
 
-    def create_dataframe(self):
-        dic = self._extract()
-        if not dic:
-            # print("unable to create dataframe.")
-            self.person_page.add_dataframe(pd.DataFrame.from_dict({}))
+    def _done(self, person):
+        return self.ledger is not None and self.ledger.status(person) not in (None, crawl_ledger.PENDING,
+                                                                              crawl_ledger.FETCHED)
+
+    def _store(self, person, person_page):
+        self.metrics.incr('done')
+        if person_page is None:
+            self.failed += 1
+            self.metrics.incr('failed')
+            self.metrics.event('failed', name=person)
+            self._mark(person, crawl_ledger.FAILED, attempt=True)
+            return
+        length = len(person_page)
+        self._mark(person, crawl_ledger.FETCHED, length=length, attempt=True)
+        if length < self.min_length:
+            self.insufficient += 1
+            self.metrics.incr('insufficient')
+            self.metrics.event('insufficient', name=person_page.name, length=length)
+            self._mark(person, crawl_ledger.INSUFFICIENT)
+            print("Insufficient data for [{}]: {}".format(person_page.name, length))
         else:
-            # self.df = pd.DataFrame.from_dict(dic, orient='index')
-            self.person_page.add_dataframe(pd.DataFrame.from_dict(dic, orient='index'))
+            self.writer.add(person_page)
 
+    def _inserted(self, written):
+        for person_page, p_id in written:
+            self.inserted += 1
+            self.metrics.incr('inserted')
+            self.metrics.event('inserted', name=person_page.name, object_id=str(p_id), length=len(person_page))
+            self._mark(person_page.name, crawl_ledger.INSERTED, object_id=str(p_id))
+            print("Inserted data for [{} ({})]: {}".format(person_page.name, p_id, len(person_page)))
 
-if __name__ == "__main__":
-    from sparql_client import SparqlClient
+    def _drain(self, running, return_when):
+        done, _ = wait(running, return_when=return_when)
+        for future in done:
+            person = running.pop(future)
+            try:
+                person_page = future.result()
+            except Exception as e:
+                print("Unable to process {}  ({}) ".format(person, e))
+                person_page = None
+            self._store(person, person_page)
+        self.writer.tick()
+        self.metrics.progress()
+
+    def run(self, people, total=None):
+        # total, when known, only feeds the ETA of the progress line
+        self.metrics.total = total
+        running = {}
+        submitted = set()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for person in people:
+                if person in submitted or self._done(person):
+                    continue
+                submitted.add(person)
+                # bounded window: never hold more than 2 * workers requests in flight
+                if len(running) >= 2 * self.workers:
+                    self._drain(running, FIRST_COMPLETED)
+                running[pool.submit(self._fetch, person)] = person
+            while running:
+                self._drain(running, ALL_COMPLETED)
+        self.writer.flush()
+        self.metrics.progress(force=True)
+        return self.inserted, self.insufficient, self.failed
+
+
+class Refresher(Harvester):
+    # incremental mode for people already stored: fetch from their last stored month on and merge
+    def __init__(self, db, last_months, **kwargs):
+        super().__init__(db, **kwargs)
+        self.last_months = last_months      # name -> months since 1970-01, see DB.last_months
+        self.writer.write = db.merge_many
+        self.months_received = 0
+        self.unchanged = 0
+
+    def _fetch(self, person):
+        # the last stored month is fetched again: it was probably still in progress at the previous run
+        res = self._client().get_history_per_person(person, since=self.last_months[person] + 1970 * 12)
+        if res is None:
+            return None
+        with self.metrics.timer('extract'):
+            d = DataCleaner(res['results']['bindings'], person)
+            d.create_dataframe()
+        return d.person_page
+
+    def _store(self, person, person_page):
+        self.metrics.incr('done')
+        if person_page is None:
+            self.failed += 1
+            self.metrics.incr('failed')
+            self.metrics.event('failed', name=person)
+            return
+        self.months_received += len(person_page)
+        self.metrics.incr('months_received', len(person_page))
+        self.writer.add(person_page)
+
+    def _inserted(self, written):
+        for person_page, p_id in written:
+            if p_id is None:        # nothing new since the last run
+                self.unchanged += 1
+                self.metrics.incr('unchanged')
+                continue
+            self.inserted += 1
+            self.metrics.incr('refreshed')
+            self.metrics.event('refreshed', name=person_page.name, object_id=str(p_id), length=len(person_page))
+            print("Refreshed data for [{} ({})]: {}".format(person_page.name, p_id, len(person_page)))
+
+
+def people_to_harvest(client, ledger, cursor_file, page_size=10000):
+    # leftovers of previous runs first, then stream new pages into the ledger as they arrive
+    for person in ledger.pending():
+        yield person
+    for page in client.iter_people_pages(page_size, cursor_file):
+        ledger.add_people(page)
+        for person in page:
+            yield person
+
+
+def main(retry_failed=False, workers=8):
     from mongodb_client import DB
+    from query_cache import QueryCache
+    import json
     import pickle
     import os
 
-    s = SparqlClient()
-    people_file = './data/people.txt'
-    if not os.path.isfile(people_file):
-        people = s.get_all_people()
-        # print("Fetched {} people".format(len(people)))
-        with open(people_file, 'wb') as fp:
-            pickle.dump(people, fp)
-    else:
-        with open(people_file, 'rb') as fp:
-            people = pickle.load(fp)
-        # print("Fetched {} people from file".format(len(people)))
+    ledger = crawl_ledger.CrawlLedger('./data/ledger.db')
+    if len(ledger) == 0:
+        people_file = './data/people.txt'
+        if os.path.isfile(people_file):
+            with open(people_file, 'rb') as fp:
+                print("Seeding ledger with {} people".format(ledger.add_people(pickle.load(fp))))
+        if os.path.isfile('./data/logfile.txt'):
+            print("Imported {} entries from logfile".format(ledger.import_logfile('./data/logfile.txt')))
 
     db = DB()
-    # TODO 98001 > data/logfile.txt
-    for person in people[98001:]:
-        res = s.get_history_per_person(person)
-        if res is None:
-            continue
-        data = res['results']['bindings']  # List of dictionaries
-        d = DataCleaner(data, person)
-        d.create_dataframe()
-        if len(d.person_page.df) < 10:
-            print("Insufficient data for [{}]: {}".format(d.person_page.name, len(d.person_page.df)))
-        else:
-            p_id = db.insert_person(d.person_page)
-            print("Inserted data for [{} ({})]: {}".format(d.person_page.name, p_id, len(d.person_page.df)))
+    ledger.reconcile(db)
+    if retry_failed:
+        print("Re-queued {} failed people".format(ledger.requeue_failed()))
+    cache = QueryCache('./data/cache', ttl=None)
+    metrics = Metrics(event_log='./data/events.jsonl')
+    h = Harvester(db, ledger=ledger, cache=cache, workers=workers, metrics=metrics)
+    h.run(people_to_harvest(SparqlClient(retries=3, backoff=2.0, metrics=metrics), ledger,
+                            './data/people_cursor.txt'))
+    metrics.close()
+    print(ledger.counts())
+    print(cache.stats())
+    print(json.dumps(metrics.snapshot()['histograms'], indent=2))
+
+
+def refresh(workers=8, people=None):
+    from mongodb_client import DB
+    db = DB()
+    last_months = db.last_months()
+    people = [p for p in people if p in last_months] if people else sorted(last_months)
+    metrics = Metrics(event_log='./data/events.jsonl', name='refresh')
+    r = Refresher(db, last_months, workers=workers, metrics=metrics)
+    refreshed, _, failed = r.run(people, total=len(people))
+    metrics.close()
+    print("Refreshed {} people ({} months received), {} unchanged, {} failed".format(
+        refreshed, r.months_received, r.unchanged, failed))
+    return refreshed, failed
+
 
+if __name__ == "__main__":
+    import sys
+    if '--refresh' in sys.argv:
+        refresh()
+    else:
+        main(retry_failed='--retry-failed' in sys.argv)
@@ -1,91 +1,241 @@
-from mongodb_client import DB
+from mongodb_client import DB, series_fingerprint
+from results_store import ResultsStore
+from transforms import TransformChain
 import log_analysis
-import utils
+import reducers
+import plots
+from ragged import RaggedSeries
 import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 class Analyzer:
-    def __init__(self):
+    def __init__(self, plots_mode='sync'):
         self.db = DB()
-        self.object_list = []       # list of mongodb identifiers
-        self.processed = {}         # False = not analyzed
+        self.plotter = plots.make_plotter(plots_mode)      # 'sync', 'deferred' or 'none'
 
-    def _acquire_object_id_list(self):
-        self.object_list = self.db.get_all_inserted()
-        self.processed = dict.fromkeys(self.object_list, False)
-
-    def do_log_analysis(self, logfile):
-        if len(self.object_list) == 0:
-            self._acquire_object_id_list()
+    def do_log_analysis(self, logfile=None):
         log_analysis.plot_distributions(logfile)
-        self.compute_ratio_rev_contrib()
+        res = self.scan([reducers.RatioRevContrib(), reducers.LastUpdate(),
+                         reducers.LengthHistogram(), reducers.Totals()])
         log_analysis.plot_ratio_rev_contrib()
-        self.find_last_update()
+        print("Last update: {}".format(res['last_update']))
+        print("Totals: {}".format(res['totals']))
+        return res
+
+    def scan(self, reducer_list, batch_size=1000):
+        # one pass over the collection, projected on the union of the fields the reducers need
+        projection = {f: 1 for r in reducer_list for f in r.fields}
+        try:
+            for doc in self.db.iter_documents(projection=projection, batch_size=batch_size):
+                for r in reducer_list:
+                    r.update(doc)
+            return {r.name: r.result() for r in reducer_list}
+        finally:
+            for r in reducer_list:
+                r.close()
 
     def compute_ratio_rev_contrib(self):
-        ratios = []
-        for object_id in self.object_list:
-            dic = self.db.get_document(object_id)
-            ratio = float(sum(dic['df'].num_rev) / dic['unique_contributors'])
-            ratios.append((object_id, ratio))
-        with open('data/ratio_rev_contrib.txt', 'w') as out:
-            for tup in ratios:
-                out.write("{}\n".format(str(tup)))
+        return self.scan([reducers.RatioRevContrib()])['ratio_rev_contrib']
 
     def find_last_update(self):
-        max_date = None
-        for object_id in self.object_list:
-            dic = self.db.get_document(object_id)
-            if not max_date or dic['df'].index[-1] > max_date:
-                max_date = dic['df'].index[-1]
+        max_date = self.scan([reducers.LastUpdate()])['last_update']
         print("Last update: {}".format(max_date))
 
-    def analyze(self, objectid):
-        failed = []
+    def analyze(self, objectid, store=None):
+        store = store or ResultsStore()
         doc = self.db.get_document(object_id=objectid)
+        records, failed = self.analyze_document(doc)
+        save_results(store, objectid, records, failed, name=doc['name'], fingerprint=series_fingerprint(doc))
+        return failed
+
+    def analyze_all(self, object_ids, batch_size=200, store=None, skip_analyzed=True):
+        store = store or ResultsStore()
+        if skip_analyzed:
+            object_ids = to_analyze(store, self.db, object_ids)
+        failed = []
+        for doc in self.db.iter_documents(object_ids, batch_size=batch_size):
+            records, doc_failed = self.analyze_document(doc)
+            save_results(store, doc['_id'], records, doc_failed, name=doc['name'],
+                         fingerprint=series_fingerprint(doc))
+            failed.extend(doc_failed)
+        return failed
+
+    def analyze_document(self, doc):
+        # returns (records, failed columns) instead of writing, so that workers hand results back to one writer
+        objectid = doc['_id']
+        records = []
+        failed = []
         name = doc['name']
-        out_dir = self.prepare_dest_folder(name)
+        out_dir = self.dest_folder(name)
         dates = doc['important_dates']
         df = doc['df']
-        stationarity_file = 'results/stationarity.txt'
-        out_stat = open(stationarity_file, 'a')
+
+        def record(transform, col, chain):
+            adftest = chain.adf(transform)
+            records.append({'object_id': str(objectid), 'name': name, 'column': col, 'transform': transform,
+                            'length': len(chain[transform]), 'adf_stat': float(adftest[0]),
+                            'p_value': float(adftest[1]), 'used_lag': int(adftest[2]), 'nobs': int(adftest[3]),
+                            'crit_1': float(adftest[4]['1%']), 'crit_5': float(adftest[4]['5%']),
+                            'crit_10': float(adftest[4]['10%']),
+                            'ic_best': float(adftest[5]) if len(adftest) > 5 else None,
+                            'stationary': chain.stationary(transform), 'acf': None, 'pacf': None})
+            return records[-1]
+
+        def acf_pacf(rec, chain, fname):
+            lag_acf, lag_pacf = chain.acf_pacf(rec['transform'])
+            self.plotter.acf_pacf(lag_acf, lag_pacf, rec['length'], os.path.join(out_dir, fname))
+            rec['acf'] = [float(v) for v in lag_acf]
+            rec['pacf'] = [float(v) for v in lag_pacf]
+
         for col in list(df.columns.values):
-            ts = df[col]
-            utils.plot_ts(ts, "{}:{}".format(name, col), os.path.join(out_dir, "orig_{}.pdf".format(col)))
-            stationarity = utils.is_stationary(ts)
-            out_stat.write("{} - ts: {} - len: {} - Stationary: {}\n".format(name, col, len(ts), stationarity))
-            if stationarity:
-                lag_acf, lag_pacf = utils.find_acf_pacf(ts, fname=os.path.join(out_dir, '{}_acf_pacf.pdf'.format(col)))
+            chain = TransformChain(df[col])
+            self.plotter.ts(chain.ts, "{}:{}".format(name, col), os.path.join(out_dir, "orig_{}.pdf".format(col)),
+                            chain=chain)
+            rec = record('ts', col, chain)
+            if rec['stationary']:
+                acf_pacf(rec, chain, '{}_acf_pacf.pdf'.format(col))
             else:
-                ts_diff = utils.differentiate(ts)
-                diff_stationarity = utils.is_stationary(ts_diff)
-                out_stat.write("{} - ts_diff: {} - len: {} - Stationary: {}\n".format(name, col, len(ts_diff), diff_stationarity))
-                if diff_stationarity:
-                    lag_acf, lag_pacf = utils.find_acf_pacf(ts_diff, fname=os.path.join(out_dir, '{}_diff_acf_pacf.pdf'.format(col)))
+                rec = record('ts_diff', col, chain)
+                if rec['stationary']:
+                    acf_pacf(rec, chain, '{}_diff_acf_pacf.pdf'.format(col))
                 else:
-                    ts_log = utils.log_transform(ts)
-                    log_stationarity = utils.is_stationary(ts_log)
-                    out_stat.write("{} - ts_log: {} - len: {} - Stationary: {}\n".format(name, col, len(ts_log), log_stationarity))
-                    if log_stationarity:
-                        lag_acf, lag_pacf = utils.find_acf_pacf(ts_diff, fname=os.path.join(out_dir, '{}_log_acf_pacf.pdf'.format(col)))
+                    rec = record('ts_log', col, chain)
+                    if rec['stationary']:
+                        acf_pacf(rec, chain, '{}_log_acf_pacf.pdf'.format(col))
                     else:
-                        out_stat.write("{} - ts: {} - len: {} - Stationary: 1st order failed\n".format(name, col, len(ts)))
-                        failed.append(objectid)
+                        failed.append((col, '1st order failed'))
+        return records, failed
 
+    def screen(self, columns=('num_rev', 'size_rev'), min_length=0, chunk=5000, store=None, series=None):
+        # batched ADF on the raw series of the whole collection, stored as the 'ts_screen' transform so that
+        # the 'ts' rows of the full analysis and their ACF/PACF are kept;
+        # with a SeriesStore as series, reads the memory-mapped columns instead of MongoDB
+        store = store or ResultsStore()
+        if series is not None:
+            for col in columns:
+                ragged = RaggedSeries.from_store(series, col).longer_than(min_length)
+                for i in range(0, len(ragged), chunk):
+                    self._screen_batch(ragged.subset(np.arange(i, min(i + chunk, len(ragged)))), col, store)
+            return len(ragged)
+        screened = 0
+        batch = []
+        for doc in self.db.iter_series(fields=('name',), query={'length': {'$gt': min_length}}):
+            batch.append(doc)
+            if len(batch) >= chunk:
+                self._screen_docs(batch, columns, store)
+                screened += len(batch)
+                batch = []
+        if batch:
+            self._screen_docs(batch, columns, store)
+            screened += len(batch)
+        return screened
 
-    def prepare_dest_folder(self, name):
-        out_dir = 'results/people/{}'.format(name)
-        if not os.path.isdir(out_dir):
-            os.mkdir(out_dir)
-        return out_dir
+    def _screen_docs(self, docs, columns, store):
+        ids, names = [str(d['_id']) for d in docs], [d['name'] for d in docs]
+        for col in columns:
+            self._screen_batch(RaggedSeries.from_arrays([d[col] for d in docs], [d['months'] for d in docs],
+                                                        ids, names), col, store)
 
+    def _screen_batch(self, ragged, col, store):
+        from batch_stationarity import stationarity_screen
+        res = stationarity_screen(ragged)
+        records = []
+        for i, (object_id, name, length) in enumerate(zip(ragged.ids, ragged.names, ragged.lengths)):
+            if res['adf_stat'][i] != res['adf_stat'][i]:      # NaN: constant or too short
+                continue
+            crit = res['crit'][i]
+            records.append({'object_id': object_id, 'name': name, 'column': col, 'transform': 'ts_screen',
+                            'length': int(length), 'adf_stat': float(res['adf_stat'][i]),
+                            'p_value': float(res['p_value'][i]), 'used_lag': int(res['used_lag'][i]),
+                            'nobs': int(res['nobs'][i]), 'crit_1': float(crit[0]), 'crit_5': float(crit[1]),
+                            'crit_10': float(crit[2]), 'ic_best': float(res['ic_best'][i]),
+                            'stationary': bool(res['stationary'][i]), 'acf': None, 'pacf': None})
+        store.upsert_records(records)
 
-if __name__ == "__main__":
+    def dest_folder(self, name):
+        return 'results/people/{}'.format(name)
+
+
+def to_analyze(store, db, object_ids):
+    # people never analyzed, or whose series changed (e.g. extended by a refresh) since they were
+    done = store.analyzed()
+    current = db.fingerprints(object_ids)
+    return [o for o in object_ids if str(o) not in done or done[str(o)] != current.get(str(o))]
+
+
+def save_results(store, object_id, records, failed, name=None, fingerprint=None):
+    doc_error = any(column == '' for column, _ in failed)
+    store.clear(object_id, records=not doc_error, commit=False)
+    store.upsert_records(records, commit=False)
+    for column, error in failed:
+        store.add_failure(object_id, column, error, commit=False)
+    if not doc_error:     # whole-document errors are retried on the next run
+        store.mark_analyzed(object_id, name=name, fingerprint=fingerprint, commit=False)
+    store.commit()
+
+
+_worker = None      # per-process Analyzer, each with its own MongoClient
+
+
+def _init_worker(plots_mode):
+    global _worker
+    import matplotlib
+    matplotlib.use('Agg')
+    _worker = Analyzer(plots_mode)
+
+
+def _analyze_chunk(object_ids):
+    results = []
+    for doc in _worker.db.iter_documents(object_ids, batch_size=len(object_ids)):
+        try:
+            records, failed = _worker.analyze_document(doc)
+            results.append((str(doc['_id']), doc['name'], series_fingerprint(doc), records, failed))
+        except Exception as e:
+            results.append((str(doc['_id']), doc['name'], None, [], [('', repr(e))]))
+    return results
+
+
+def run_parallel(object_ids, workers=None, chunksize=10, store=None, skip_analyzed=True, plots_mode='deferred'):
+    # workers fetch and analyze their own chunks, results are stored here only
+    store = store or ResultsStore()
+    object_ids = [str(o) for o in object_ids]
+    if skip_analyzed:
+        object_ids = to_analyze(store, DB(), object_ids)
+    chunks = [object_ids[i:i + chunksize] for i in range(0, len(object_ids), chunksize)]
+    summary = {'series': 0, 'failed': []}
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(plots_mode,)) as pool:
+        futures = [pool.submit(_analyze_chunk, chunk) for chunk in chunks]
+        for future in as_completed(futures):
+            for object_id, name, fingerprint, records, failed in future.result():
+                save_results(store, object_id, records, failed, name=name, fingerprint=fingerprint)
+                summary['series'] += 1
+                summary['failed'].extend((object_id, column, error) for column, error in failed)
+            elapsed = time.time() - start
+            print("Analyzed {}/{} series ({:.2f} series/s)".format(summary['series'], len(object_ids),
+                                                                 summary['series'] / elapsed))
+    summary['elapsed'] = time.time() - start
+    summary['throughput'] = summary['series'] / summary['elapsed'] if summary['elapsed'] else 0.0
+    return summary
+
+
+def main(logfile=None, min_length=130, workers=None, plots_mode='deferred', skip_log_analysis=False):
     a = Analyzer()
-    logfile = 'data/logfile.txt'
-    a.do_log_analysis(logfile)
-    dic = log_analysis.find_longest_ts(logfile, larger_than=130)
+    if not skip_log_analysis:
+        a.do_log_analysis(logfile)     # None: every default logfile
+    dic = a.db.get_longer_than(min_length)
     print("Starting the analysis of {} ts".format(len(dic)))
-    for obj in dic:
-        a.analyze(obj)
+    summary = run_parallel(list(dic), workers=workers or os.cpu_count(), plots_mode=plots_mode)
+    print("Analyzed {} series in {:.1f}s ({:.2f} series/s), {} failed".format(
+        summary['series'], summary['elapsed'], summary['throughput'], len(summary['failed'])))
+    if plots_mode == 'deferred':
+        print("Figures spooled, render them with plots.py")
+    return summary
+
 
+if __name__ == "__main__":
+    main()
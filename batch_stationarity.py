@@ -0,0 +1,240 @@
+import numpy as np
+from ragged import RaggedSeries
+from statsmodels.tsa.adfvalues import mackinnonp, mackinnoncrit
+
+# same statistics as statsmodels adfuller/kpss, computed for many series at once: series are grouped by
+# length, every group shares one design shape and is solved with a single stacked QR decomposition
+
+_mackinnonp = np.vectorize(lambda stat, regression: mackinnonp(stat, regression=regression, N=1), otypes=[float])
+
+kpss_crit = {'c': [0.347, 0.463, 0.574, 0.739], 'ct': [0.119, 0.146, 0.176, 0.216]}
+kpss_pvals = [0.10, 0.05, 0.025, 0.01]
+
+
+def as_ragged(values, lengths=None):
+    # list of 1-D arrays, a RaggedSeries, or a 2-D array of left-aligned series with their lengths
+    if isinstance(values, RaggedSeries):
+        return values, values.lengths
+    if lengths is None:
+        if isinstance(values, np.ndarray) and values.ndim == 2:
+            lengths = np.full(values.shape[0], values.shape[1])
+        else:
+            values = [np.asarray(v, dtype=np.float64) for v in values]
+            lengths = np.array([len(v) for v in values], dtype=np.int64)
+    return values, np.asarray(lengths, dtype=np.int64)
+
+
+def _length_groups(values, lengths):
+    for n in np.unique(lengths):
+        idx = np.flatnonzero(lengths == n)
+        if isinstance(values, RaggedSeries):
+            x = values.take(idx, n)
+        elif isinstance(values, np.ndarray):
+            x = np.asarray(values[idx, :n], dtype=np.float64)
+        else:
+            x = np.stack([values[i] for i in idx]).astype(np.float64)
+        yield idx, int(n), x
+
+
+def _trend(nobs, regression):
+    if regression == 'n':
+        return np.empty((nobs, 0))
+    if regression == 'c':
+        return np.ones((nobs, 1))
+    if regression == 'ct':
+        return np.column_stack([np.ones(nobs), np.arange(1, nobs + 1, dtype=np.float64)])
+    raise ValueError("regression {} not understood".format(regression))
+
+
+def _lagged(x, xdiff, lag, nlags):
+    # rows t = lag..n-2 of the ADF regression: level x[t], then diff lags xdiff[t - 1] .. xdiff[t - nlags]
+    nobs = xdiff.shape[1] - lag
+    y = xdiff[:, lag:]
+    level = x[:, lag:lag + nobs]
+    lags = [xdiff[:, lag - i:lag - i + nobs] for i in range(1, nlags + 1)]
+    return y, level, lags, nobs
+
+
+def _autolag(x, xdiff, maxlag, regression, autolag):
+    # nested OLS fits [trend, level, lag_1 .. lag_k] share the QR of the full design: ssr_k from its prefix
+    y, level, lags, nobs = _lagged(x, xdiff, maxlag, maxlag)
+    g = x.shape[0]
+    trend = np.broadcast_to(_trend(nobs, regression), (g, nobs, len(regression) if regression != 'n' else 0))
+    design = np.concatenate([trend, level[:, :, None]] + [l[:, :, None] for l in lags], axis=2)
+    q, r = np.linalg.qr(design)
+    qty = np.einsum('gnk,gn->gk', q, y)
+    ssr = np.einsum('gn,gn->g', y, y)[:, None] - np.cumsum(qty ** 2, axis=1)
+    startlag = design.shape[2] - maxlag
+    k = np.arange(startlag, design.shape[2] + 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        llf = -nobs / 2.0 * (np.log(2 * np.pi) + np.log(ssr[:, k - 1] / nobs) + 1)
+    penalty = 2.0 * k if autolag == 'aic' else np.log(nobs) * k
+    ic = -2.0 * llf + penalty
+    best = np.argmin(np.where(np.isnan(ic), np.inf, ic), axis=1)      # ties go to the smaller lag
+    return best, ic[np.arange(g), best]
+
+
+def _adf_tstat(x, xdiff, lag, regression):
+    # level as last column: its t-value is sign(R_kk) * (Q'y)_k / s
+    y, level, lags, nobs = _lagged(x, xdiff, lag, lag)
+    g = x.shape[0]
+    trend = np.broadcast_to(_trend(nobs, regression), (g, nobs, len(regression) if regression != 'n' else 0))
+    design = np.concatenate([trend] + [l[:, :, None] for l in lags] + [level[:, :, None]], axis=2)
+    q, r = np.linalg.qr(design)
+    qty = np.einsum('gnk,gn->gk', q, y)
+    resid = y - np.einsum('gnk,gk->gn', q, qty)
+    dof = nobs - design.shape[2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.sqrt(np.einsum('gn,gn->g', resid, resid) / dof)
+        return np.sign(r[:, -1, -1]) * qty[:, -1] / s, nobs
+
+
+def batch_adf(values, lengths=None, maxlag=None, regression='c', autolag='AIC'):
+    values, lengths = as_ragged(values, lengths)
+    autolag = autolag.lower() if autolag else None
+    ntrend = len(regression) if regression != 'n' else 0
+    size = len(lengths)
+    res = {'adf_stat': np.full(size, np.nan), 'p_value': np.full(size, np.nan),
+           'used_lag': np.full(size, -1, dtype=np.int64), 'nobs': np.zeros(size, dtype=np.int64),
+           'crit': np.full((size, 3), np.nan), 'ic_best': np.full(size, np.nan)}
+    for idx, n, x in _length_groups(values, lengths):
+        group_maxlag = maxlag
+        if group_maxlag is None:
+            group_maxlag = min(n // 2 - ntrend - 1, int(np.ceil(12.0 * np.power(n / 100.0, 1 / 4.0))))
+        if group_maxlag < 0 or n // 2 - ntrend - 1 < group_maxlag:
+            continue        # too short, adfuller raises here
+        valid = x.max(axis=1) != x.min(axis=1)        # constant series, adfuller raises here
+        idx, x = idx[valid], x[valid]
+        if len(idx) == 0:
+            continue
+        xdiff = np.diff(x, axis=1)
+        if autolag:
+            used, ic = _autolag(x, xdiff, group_maxlag, regression, autolag)
+            res['ic_best'][idx] = ic
+        else:
+            used = np.full(len(idx), group_maxlag)
+        for lag in np.unique(used):
+            sel = used == lag
+            stat, nobs = _adf_tstat(x[sel], xdiff[sel], int(lag), regression)
+            res['adf_stat'][idx[sel]] = stat
+            res['used_lag'][idx[sel]] = lag
+            res['nobs'][idx[sel]] = nobs
+            res['crit'][idx[sel]] = mackinnoncrit(N=1, regression=regression, nobs=nobs)
+    ok = ~np.isnan(res['adf_stat'])
+    res['p_value'][ok] = _mackinnonp(res['adf_stat'][ok], regression)
+    return res
+
+
+def _kpss_autolag(resid, n):
+    covlags = int(np.power(n, 2.0 / 9.0))
+    s0 = np.einsum('gn,gn->g', resid, resid) / n
+    s1 = np.zeros(resid.shape[0])
+    for i in range(1, covlags + 1):
+        prod = np.einsum('gn,gn->g', resid[:, i:], resid[:, :n - i]) / (n / 2.0)
+        s0 += prod
+        s1 += i * prod
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s_hat = s1 / s0
+        gamma_hat = 1.1447 * np.power(s_hat * s_hat, 1.0 / 3.0)
+        lags = gamma_hat * np.power(n, 1.0 / 3.0)
+    return np.where(np.isfinite(lags), lags, 0).astype(np.int64)
+
+
+def batch_kpss(values, lengths=None, regression='c', nlags='auto'):
+    values, lengths = as_ragged(values, lengths)
+    crit = kpss_crit[regression]
+    size = len(lengths)
+    res = {'kpss_stat': np.full(size, np.nan), 'p_value': np.full(size, np.nan),
+           'lags': np.zeros(size, dtype=np.int64)}
+    for idx, n, x in _length_groups(values, lengths):
+        if regression == 'ct':
+            design = np.column_stack([np.ones(n), np.arange(1, n + 1, dtype=np.float64)])
+            beta = np.linalg.lstsq(design, x.T, rcond=None)[0]
+            resid = x - (design @ beta).T
+        else:
+            resid = x - x.mean(axis=1, keepdims=True)
+        if nlags == 'auto':
+            lags = np.minimum(_kpss_autolag(resid, n), n - 1)
+        elif nlags == 'legacy':
+            lags = np.full(len(idx), min(int(np.ceil(12.0 * np.power(n / 100.0, 1 / 4.0))), n - 1))
+        else:
+            lags = np.full(len(idx), int(nlags))
+        eta = np.sum(np.cumsum(resid, axis=1) ** 2, axis=1) / (n ** 2)
+        s_hat = np.einsum('gn,gn->g', resid, resid)
+        for i in range(1, int(lags.max()) + 1 if len(lags) else 1):
+            weight = np.where(i <= lags, 1.0 - i / (lags + 1.0), 0.0)
+            s_hat += 2 * weight * np.einsum('gn,gn->g', resid[:, i:], resid[:, :n - i])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stat = eta / (s_hat / n)
+        res['kpss_stat'][idx] = stat
+        res['lags'][idx] = lags
+        res['p_value'][idx] = np.interp(stat, crit, kpss_pvals)
+    return res
+
+
+def stationarity_screen(values, lengths=None):
+    # vectorized utils.stationary: p < 0.5 and the statistic below at least one critical value
+    res = batch_adf(values, lengths)
+    with np.errstate(invalid='ignore'):
+        res['stationary'] = (res['p_value'] < 0.5) & np.any(res['crit'] > res['adf_stat'][:, None], axis=1)
+    return res
+
+
+def validation_corpus(n_series=300, min_length=20, max_length=300, seed=0):
+    rnd = np.random.RandomState(seed)
+    corpus = []
+    for i in range(n_series):
+        n = rnd.randint(min_length, max_length + 1)
+        kind = i % 4
+        e = rnd.normal(size=n)
+        if kind == 0:
+            x = np.cumsum(e)                            # random walk
+        elif kind == 1:
+            x = np.zeros(n)                             # AR(1)
+            for t in range(1, n):
+                x[t] = 0.6 * x[t - 1] + e[t]
+        elif kind == 2:
+            x = 0.05 * np.arange(n) + e                 # trend
+        else:
+            x = rnd.poisson(20, size=n).astype(float)   # revision counts
+        corpus.append(x)
+    return corpus
+
+
+def validate(corpus=None, tol=1e-6):
+    from statsmodels.tsa.stattools import adfuller, kpss
+    import warnings
+    corpus = corpus if corpus is not None else validation_corpus()
+    adf_res = batch_adf(corpus)
+    kpss_res = batch_kpss(corpus)
+    lag_match, stat_diff, p_diff, kpss_diff = 0, 0.0, 0.0, 0.0
+    for i, x in enumerate(corpus):
+        ref = adfuller(x, autolag='AIC')
+        if ref[2] == adf_res['used_lag'][i]:
+            lag_match += 1
+            stat_diff = max(stat_diff, abs(ref[0] - adf_res['adf_stat'][i]))
+            p_diff = max(p_diff, abs(ref[1] - adf_res['p_value'][i]))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            ref = kpss(x, regression='c', nlags='auto')
+        kpss_diff = max(kpss_diff, abs(ref[0] - kpss_res['kpss_stat'][i]))
+    report = {'series': len(corpus), 'adf_lag_agreement': lag_match / float(len(corpus)),
+              'adf_max_stat_diff': stat_diff, 'adf_max_pvalue_diff': p_diff, 'kpss_max_stat_diff': kpss_diff}
+    report['ok'] = report['adf_lag_agreement'] > 0.99 and stat_diff < tol and kpss_diff < tol
+    return report
+
+
+if __name__ == "__main__":
+    import time
+    from statsmodels.tsa.stattools import adfuller
+    print(validate())
+    corpus = validation_corpus(2000, 130, 200)
+    start = time.perf_counter()
+    stationarity_screen(corpus)
+    batch = time.perf_counter() - start
+    start = time.perf_counter()
+    for x in corpus:
+        adfuller(x, autolag='AIC')
+    single = time.perf_counter() - start
+    print("adf on {} series: adfuller {:.2f}s, batch {:.2f}s ({:.1f}x)".format(len(corpus), single, batch,
+                                                                              single / batch))
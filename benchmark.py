@@ -0,0 +1,376 @@
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import synthetic
+from kde import BinnedKDE
+from acquire import DataCleaner
+
+
+class LegacyDataCleaner(DataCleaner):
+    # regex-based two-pass extraction as it was before the single-pass rewrite, kept as reference
+    def get_secondary_keys(self):
+        for dic in self.data:
+            if 'p2' in dic:
+                if re.search('birthDate', dic['p2']['value']):
+                    self.person_page.add_birth_date(self._convert_complete_date(dic['v2']['value']))
+                if re.search('deathDate', dic['p2']['value']):
+                    self.person_page.add_death_date(self._convert_complete_date(dic['v2']['value']))
+                if re.search('Fonction', dic['p2']['value']):
+                    self.person_page.add_important_date(self._convert_complete_date(dic['v2']['value']))
+
+            if re.search('uniqueContributorNb', dic['p']['value']):
+                self.person_page.add_unique_contributors(int(dic['v']['value']))
+
+    def _extract(self):
+        nodeid_dic = {}
+        self.get_secondary_keys()
+        for dic in self.data:       # first, from data to {nodeid: [num, timestamp]}
+            for k, v in dic.items():
+                if re.search('revPerMonth', v['value']):
+                    nodeid = dic['v']['value']
+                    if nodeid not in nodeid_dic:
+                        nodeid_dic[nodeid] = {'num_rev': 0, 'month': 0, 'size_rev': 0}
+                    value_string = dic['v2']['value']
+                    try:
+                        value = int(value_string)
+                        nodeid_dic[nodeid]['num_rev'] = value
+                    except ValueError:
+                        value = self._convert_date(value_string, month=True)
+                        nodeid_dic[nodeid]['month'] = value
+
+                elif re.search('averageSizePerMonth', v['value']):
+                    nodeid = dic['v']['value']
+                    if nodeid not in nodeid_dic:
+                        nodeid_dic[nodeid] = {'num_rev': 0, 'month': 0, 'size_rev': 0}
+                    value_string = dic['v2']['value']
+                    try:
+                        value = float(value_string)
+                        nodeid_dic[nodeid]['size_rev'] = value
+                    except ValueError:
+                        value = self._convert_date(value_string, month=True)
+                        nodeid_dic[nodeid]['month'] = value
+
+        if len(nodeid_dic) == 0:
+            # print("{} page has no information on revPerMonth".format(self.person_page.name))
+            # print("Skipping")
+            return None
+        assert [re.match('nodeID', k) for k in nodeid_dic]
+
+        time_dic = {}           # second, from {nodeid: [num, timestamp, size]} to {timestamp: {num, size}}
+        for _, v in nodeid_dic.items():
+            if v['month'] not in time_dic:
+                time_dic[v['month']] = {'num_rev': 0, 'size_rev': 0}
+            time_dic[v['month']]['num_rev'] += v['num_rev']
+            time_dic[v['month']]['size_rev'] += v['size_rev']
+        return time_dic
+
+    def _convert_date(self, datestring, month=False):
+        if month:
+            return pd.to_datetime(datestring, format="%m/%Y")
+        else:
+            return pd.to_datetime(datestring, format="%Y")
+
+    def _convert_complete_date(self, datestring):
+        try:
+            return pd.to_datetime(datestring.split("+")[0], format="%Y-%m-%d", infer_datetime_format=True)
+        except:
+            return datestring.split("+")[0]
+
+    def create_dataframe(self):
+        dic = self._extract()
+        if not dic:
+            # print("unable to create dataframe.")
+            self.person_page.add_dataframe(pd.DataFrame.from_dict({}))
+        else:
+            # self.df = pd.DataFrame.from_dict(dic, orient='index')
+            self.person_page.add_dataframe(pd.DataFrame.from_dict(dic, orient='index'))
+
+
+def _best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_extraction(months=3000, repeat=5):
+    data = synthetic.make_history_bindings('Benchmark_Person', months=months)
+
+    def run(cls):
+        d = cls(data, 'Benchmark_Person')
+        d.create_dataframe()
+        return d.person_page
+
+    legacy, current = run(LegacyDataCleaner), run(DataCleaner)
+    pd.testing.assert_frame_equal(legacy.df.sort_index(), current.df, check_dtype=False, check_freq=False)
+    assert legacy.birth_date == current.birth_date and legacy.unique_contributors == current.unique_contributors
+    t_legacy = _best_of(lambda: run(LegacyDataCleaner), repeat)
+    t_current = _best_of(lambda: run(DataCleaner), repeat)
+    print("extraction: {} bindings, {} months".format(len(data), months))
+    print("  legacy:  {:.4f}s".format(t_legacy))
+    print("  current: {:.4f}s  ({:.1f}x)".format(t_current, t_legacy / t_current))
+    return t_legacy, t_current
+
+
+def bench_kde(n, points=100, repeat=1, seed=0):
+    from scipy.stats import gaussian_kde
+    # lengths shaped like the logfile: many short series, a long tail
+    lengths = np.random.RandomState(seed).negative_binomial(2, 0.02, size=int(n)).astype(np.float64)
+    grid = np.linspace(lengths.min(), lengths.max(), points)
+    exact = gaussian_kde(lengths)(grid)
+    binned = BinnedKDE(lengths)(grid)
+    t_exact = _best_of(lambda: gaussian_kde(lengths)(grid), repeat)
+    t_binned = _best_of(lambda: BinnedKDE(lengths)(grid), repeat)
+    err = np.max(np.abs(exact - binned)) / np.max(exact)
+    print("kde: {} samples, {} points".format(int(n), points))
+    print("  gaussian_kde: {:.4f}s".format(t_exact))
+    print("  binned:       {:.4f}s  ({:.1f}x, max rel. error {:.2e})".format(t_binned, t_exact / t_binned, err))
+    return t_exact, t_binned, err
+
+
+# --- pipeline suite: synthetic fixtures, one measurement per stage, baseline comparison ---
+
+default_config = {'people': 200, 'months': 120, 'spread': 0.5, 'plots': 10, 'log_lines': 200000,
+                  'workers': 8, 'latency': 0.005, 'seed': 0, 'database': 'webts_bench'}
+
+
+def make_fixtures(config):
+    # person -> raw SPARQL response bytes, series length drawn around config['months']
+    rnd = random.Random(config['seed'])
+    people = synthetic.make_people(config['people'], config['seed'])
+    lo = max(12, int(config['months'] * (1 - config['spread'])))
+    hi = max(lo, int(config['months'] * (1 + config['spread'])))
+    return {p: json.dumps(synthetic.make_history(p, months=rnd.randint(lo, hi))).encode('utf-8') for p in people}
+
+
+def measure(fn, items, repeat=3):
+    # best-of wall time, then one extra run under tracemalloc for the peak of Python allocations
+    elapsed = _best_of(fn, repeat)
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'items': items, 'seconds': elapsed, 'throughput': items / elapsed if elapsed else float('inf'),
+            'peak_mb': peak / 2 ** 20}
+
+
+class MemorySink:
+    # stands in for DB when no MongoDB server is reachable: documents are encoded, then dropped
+    def insert_many(self, personpages):
+        from mongodb_client import person_document
+        from bson.objectid import ObjectId
+        for p in personpages:
+            person_document(p)
+        return [ObjectId() for _ in personpages]
+
+
+def _mongo_available(timeout_ms=500):
+    from pymongo import MongoClient
+    try:
+        MongoClient(serverSelectionTimeoutMS=timeout_ms).server_info()
+        return True
+    except Exception:
+        return False
+
+
+def bench_stages(config, repeat=3, stages=None, workdir=None):
+    # a temporary workdir made here is removed afterwards, even when a stage fails; a workdir passed in is kept
+    if workdir is not None:
+        return _run_stages(config, repeat, stages, workdir)
+    workdir = tempfile.mkdtemp(prefix='webts_bench_')
+    try:
+        return _run_stages(config, repeat, stages, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _run_stages(config, repeat, stages, workdir):
+    from acquire import DataCleaner
+    from mongodb_client import person_document
+    import batch_stationarity
+    import log_analysis
+    import utils
+    fixtures = make_fixtures(config)
+    results = {}
+
+    def wanted(stage):
+        return stages is None or stage in stages
+
+    parsed = {p: json.loads(raw)['results']['bindings'] for p, raw in fixtures.items()}
+    if wanted('parse'):
+        results['parse'] = measure(lambda: [json.loads(raw) for raw in fixtures.values()], len(fixtures), repeat)
+
+    def clean():
+        pages = []
+        for person, bindings in parsed.items():
+            d = DataCleaner(bindings, person)
+            d.create_dataframe()
+            pages.append(d.person_page)
+        return pages
+
+    pages = clean()
+    if wanted('clean'):
+        results['clean'] = measure(clean, len(pages), repeat)
+
+    if wanted('encode'):
+        results['encode'] = measure(lambda: [person_document(p) for p in pages], len(pages), repeat)
+
+    if wanted('store') and _mongo_available():
+        from mongodb_client import DB
+        db = DB(config['database'])     # throwaway database, never the production collection
+        try:
+            results['store'] = measure(lambda: db.insert_many(pages), len(pages), repeat)
+            ids = db.insert_many(pages)
+            results['load'] = measure(lambda: list(db.iter_documents(ids=ids)), len(pages), repeat)
+        finally:
+            db.drop()
+
+    if wanted('fetch'):
+        from fake_endpoint import FakeSparqlEndpoint
+        from sparql_client import SparqlClient
+        people = list(fixtures)[:50]
+        with FakeSparqlEndpoint(people=people, months=config['months'], seed=config['seed']) as endpoint:
+            client = SparqlClient(endpoint.url)
+            results['fetch'] = measure(lambda: [client.get_history_per_person(p) for p in people], len(people), 1)
+
+    series = [p.num_rev.astype(np.float64) for p in pages if len(p) > 20]
+    if wanted('stationarity'):
+        results['stationarity'] = measure(lambda: [utils.adf(x) for x in series], len(series), 1)
+        results['stationarity_batch'] = measure(lambda: batch_stationarity.stationarity_screen(series),
+                                                len(series), repeat)
+
+    if wanted('plot'):
+        import plots
+        plotter = plots.SyncPlotter()
+        frames = [p.df['num_rev'] for p in pages[:config['plots']]]
+        results['plot'] = measure(lambda: [plotter.ts(ts, 'bench', os.path.join(workdir, 'plots', '{}.pdf'.format(i)))
+                                           for i, ts in enumerate(frames)], len(frames), 1)
+
+    if wanted('logstats'):
+        logfile = os.path.join(workdir, 'logfile.txt')
+        rnd = np.random.RandomState(config['seed'])
+        with open(logfile, 'w') as out:
+            out.write("Starting\n")
+            for i, l in enumerate(rnd.negative_binomial(2, 0.02, size=config['log_lines'])):
+                out.write("Inserted data for [Person_{} ({:024x})]: {}\n".format(i, i, l))
+        results['logstats'] = measure(lambda: log_analysis.length_stats(log_analysis.scan_logfile(logfile)[0]),
+                                      config['log_lines'], repeat)
+    return results
+
+
+def bench_end_to_end(config):
+    # fake endpoint -> Harvester (threads, retries) -> DataCleaner -> BufferedWriter -> MongoDB or MemorySink
+    import contextlib
+    import io
+    from acquire import Harvester
+    from fake_endpoint import FakeSparqlEndpoint
+    db = None
+    if _mongo_available():
+        from mongodb_client import DB
+        db = DB(config['database'])
+    storage = 'mongodb' if db is not None else 'memory'
+    people = synthetic.make_people(config['people'], config['seed'])
+    try:
+        with FakeSparqlEndpoint(people=people, months=config['months'], latency=config['latency'],
+                                seed=config['seed']) as endpoint:
+            def harvest():
+                harvester = Harvester(db or MemorySink(), url=endpoint.url, workers=config['workers'], retries=0)
+                with contextlib.redirect_stdout(io.StringIO()):     # per-person progress lines
+                    return harvester.run(people)
+
+            start = time.perf_counter()
+            inserted, insufficient, failed = harvest()
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()     # separate run: tracing slows the threads down several times
+            try:
+                harvest()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    finally:
+        if db is not None:
+            db.drop()
+    return {'items': len(people), 'seconds': elapsed, 'throughput': len(people) / elapsed,
+            'peak_mb': peak / 2 ** 20, 'inserted': inserted, 'failed': failed, 'storage': storage}
+
+
+def run_suite(config=None, repeat=3, stages=None, end_to_end=True):
+    config = dict(default_config, **(config or {}))
+    results = bench_stages(config, repeat, stages)
+    if end_to_end and (stages is None or 'end_to_end' in stages):
+        results['end_to_end'] = bench_end_to_end(config)
+    return {'config': config, 'created': time.time(), 'results': results}
+
+
+def save_baseline(report, fname):
+    os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
+    with open(fname, 'w') as out:
+        json.dump(report, out, indent=2)
+
+
+def compare(report, baseline, tolerance=0.2):
+    # throughput ratio per stage against the baseline; below 1 - tolerance counts as a regression
+    rows = []
+    for stage, res in report['results'].items():
+        base = baseline['results'].get(stage)
+        ratio = res['throughput'] / base['throughput'] if base and base['throughput'] else None
+        rows.append((stage, res, base, ratio, ratio is not None and ratio < 1 - tolerance))
+    return rows
+
+
+def print_report(report, baseline=None, tolerance=0.2):
+    if baseline is not None and baseline.get('config') != report['config']:
+        print("warning: baseline was recorded with a different config")
+    rows = compare(report, baseline, tolerance) if baseline else \
+        [(stage, res, None, None, False) for stage, res in report['results'].items()]
+    print("{:<20}{:>10}{:>12}{:>14}{:>11}{:>12}".format('stage', 'items', 'seconds', 'items/s', 'peak MB',
+                                                      'vs base'))
+    for stage, res, base, ratio, regressed in rows:
+        print("{:<20}{:>10}{:>12.4f}{:>14.1f}{:>11.1f}{:>12}".format(
+            stage, res['items'], res['seconds'], res['throughput'], res['peak_mb'],
+            '' if ratio is None else '{:.2f}x{}'.format(ratio, ' !!' if regressed else '')))
+    return [stage for stage, _, _, _, regressed in rows if regressed]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipeline benchmarks on synthetic SPARQL fixtures")
+    parser.add_argument('--people', type=int, default=default_config['people'])
+    parser.add_argument('--months', type=int, default=default_config['months'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stages', nargs='*', help="subset of parse clean encode store fetch stationarity "
+                                                    "plot logstats end_to_end")
+    parser.add_argument('--baseline', default='results/benchmark_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--micro', action='store_true', help="legacy extraction and KDE comparisons")
+    args = parser.parse_args()
+    if args.micro:
+        for months in (120, 1200, 3000):
+            bench_extraction(months)
+        for n in (1e4, 1e5, 1e6, 1e7):
+            bench_kde(n)
+    else:
+        report = run_suite({'people': args.people, 'months': args.months}, args.repeat, args.stages)
+        baseline = None
+        if os.path.isfile(args.baseline) and not args.save_baseline:
+            with open(args.baseline, 'r') as infile:
+                baseline = json.load(infile)
+        regressions = print_report(report, baseline, args.tolerance)
+        if args.save_baseline:
+            save_baseline(report, args.baseline)
+            print("Baseline saved to {}".format(args.baseline))
+        if regressions:
+            exit("Regressions: {}".format(", ".join(regressions)))
@@ -0,0 +1,186 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# heavy modules are imported inside the subcommands, so `cli.py longest` never loads pandas or matplotlib
+
+# seconds for a bare `import <module>` in a fresh interpreter
+import_budget = {'cli': 0.1, 'crawl_ledger': 0.1, 'metrics': 0.1, 'results_store': 0.1, 'log_analysis': 0.4,
+                 'utils': 0.4, 'forecast': 0.4, 'acquire': 1.0, 'analysis': 1.0}
+
+
+def cmd_acquire(args):
+    import acquire
+    acquire.main(retry_failed=args.retry_failed, workers=args.workers)
+
+
+def cmd_refresh(args):
+    import acquire
+    acquire.refresh(workers=args.workers, people=args.people)
+
+
+def cmd_stats(args):
+    import log_analysis
+    lengths, _ = log_analysis.scan_logfile(args.logfile)
+    res = log_analysis.compute_stats(lengths, args.output) if args.output else log_analysis.length_stats(lengths)
+    for key, value in res.items():
+        print("{}: {}".format(key, value))
+    if args.plot:
+        log_analysis.plot_distributions(args.logfile, kde_method=args.kde)
+
+
+def cmd_longest(args):
+    import log_analysis
+    res = log_analysis.find_longest_ts(args.logfile, args.larger_than)
+    if args.list:
+        for object_id, length in sorted(res.items(), key=lambda item: -item[1]):
+            print("{} {}".format(object_id, length))
+    print("{} series longer than {} months".format(len(res), args.larger_than))
+
+
+def cmd_analyze(args):
+    import analysis
+    if args.screen:
+        from series_store import SeriesStore
+        a = analysis.Analyzer('none')
+        series = SeriesStore(args.series_store) if args.series_store else None
+        print("Screened {} series".format(a.screen(min_length=args.min_length, series=series)))
+        return
+    analysis.main(logfile=args.logfile, min_length=args.min_length, workers=args.workers, plots_mode=args.plots,
+                  skip_log_analysis=args.skip_log_analysis)
+
+
+def cmd_export(args):
+    from mongodb_client import DB
+    from series_store import SeriesStore
+    store = SeriesStore(args.path)
+    print("Synced {} people".format(store.sync(DB())))
+    if args.compact:
+        print("Dropped {} superseded rows".format(store.compact()))
+    print("{} people, {} months stored, {} garbage rows".format(len(store), int(store.lengths().sum()),
+                                                               store.garbage()))
+
+
+def cmd_similar(args):
+    import similarity
+    from series_store import SeriesStore
+    store = SeriesStore(args.series_store)
+    if os.path.isfile(os.path.join(args.path, 'index.json')):
+        index = similarity.SimilarityIndex.load(args.path)
+        print("Indexed {} new people".format(index.sync(store)))
+    else:
+        index = similarity.SimilarityIndex.from_store(store, column=args.column, segment=args.segment)
+    index.save(args.path)
+    for person in args.people:
+        object_id = store.ids[store.position[person]]
+        print(person)
+        for other, name, distance in index.query(object_id, k=args.k):
+            print("  {:.3f} {} ({})".format(distance, name, other))
+
+
+def cmd_forecast(args):
+    import forecast
+    forecast.main(column=args.column, workers=args.workers, timeout=args.timeout, holdout=args.holdout,
+                  retry_errors=args.retry_errors, series_store=args.series_store)
+
+
+def measure_import(module):
+    code = "import time; t = time.perf_counter(); import {}; print(time.perf_counter() - t)".format(module)
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def cmd_importtime(args):
+    over = []
+    for module, budget in sorted(import_budget.items()):
+        elapsed = min(measure_import(module) for _ in range(args.repeat))
+        flag = '' if elapsed <= budget else '  over budget'
+        print("{:<16}{:>8.3f}s  (budget {:.1f}s){}".format(module, elapsed, budget, flag))
+        if flag:
+            over.append(module)
+    if over:
+        exit("Import budget exceeded: {}".format(", ".join(over)))
+
+
+logfile_help = "repeatable; default: data/logfile.txt and data/events.jsonl, one length per person"
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description="Wikipedia people time series pipeline")
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+
+    p = sub.add_parser('acquire', help="harvest the people histories into MongoDB")
+    p.add_argument('--retry-failed', action='store_true')
+    p.add_argument('--workers', type=int, default=8)
+    p.set_defaults(func=cmd_acquire)
+
+    p = sub.add_parser('refresh', help="fetch only the new months of the people already stored")
+    p.add_argument('--workers', type=int, default=8)
+    p.add_argument('people', nargs='*', help="default: everyone stored")
+    p.set_defaults(func=cmd_refresh)
+
+    p = sub.add_parser('stats', help="length statistics from the logfile and the event log")
+    p.add_argument('--logfile', action='append', help=logfile_help)
+    p.add_argument('--output', help="also write them to this file, e.g. results/stats.txt")
+    p.add_argument('--plot', action='store_true', help="plot the length distribution")
+    p.add_argument('--kde', choices=('binned', 'exact'), default='binned')
+    p.set_defaults(func=cmd_stats)
+
+    p = sub.add_parser('longest', help="object ids of the longest series")
+    p.add_argument('--logfile', action='append', help=logfile_help)
+    p.add_argument('--larger-than', type=int, default=150)
+    p.add_argument('--list', action='store_true')
+    p.set_defaults(func=cmd_longest)
+
+    p = sub.add_parser('analyze', help="stationarity analysis of the stored series")
+    p.add_argument('--logfile', action='append', help=logfile_help)
+    p.add_argument('--min-length', type=int, default=130)
+    p.add_argument('--workers', type=int)
+    p.add_argument('--plots', choices=('sync', 'deferred', 'none'), default='deferred')
+    p.add_argument('--skip-log-analysis', action='store_true')
+    p.add_argument('--screen', action='store_true', help="batched ADF screen of the raw series only")
+    p.add_argument('--series-store', help="screen from this SeriesStore instead of MongoDB")
+    p.set_defaults(func=cmd_analyze)
+
+    p = sub.add_parser('export', help="sync the columnar series store from MongoDB")
+    p.add_argument('--path', default='data/series_store')
+    p.add_argument('--compact', action='store_true')
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser('similar', help="update the similarity index and query the nearest people")
+    p.add_argument('people', nargs='*', help="names or object ids")
+    p.add_argument('-k', type=int, default=10)
+    p.add_argument('--path', default='data/similarity')
+    p.add_argument('--series-store', default='data/series_store')
+    p.add_argument('--column', default='num_rev')
+    p.add_argument('--segment', type=int, default=6, help="months per PAA segment")
+    p.set_defaults(func=cmd_similar)
+
+    p = sub.add_parser('forecast', help="fit ARIMA models to the stationary series and report holdout RMSE")
+    p.add_argument('--column', help="default: every analyzed column")
+    p.add_argument('--workers', type=int)
+    p.add_argument('--timeout', type=float, default=10.0, help="seconds allowed per fit")
+    p.add_argument('--holdout', type=int, default=12, help="months held out for the RMSE")
+    p.add_argument('--retry-errors', action='store_true', help="refit the series whose last fit failed")
+    p.add_argument('--series-store', default='data/series_store')
+    p.set_defaults(func=cmd_forecast)
+
+    p = sub.add_parser('importtime', help="check module import times against the budget")
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=cmd_importtime)
+    return parser
+
+
+def main(argv=None):
+    start = time.perf_counter()
+    args = build_parser().parse_args(argv)
+    args.func(args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import re
+import sqlite3
+import time
+
+PENDING = 'pending'
+FETCHED = 'fetched'
+INSERTED = 'inserted'
+INSUFFICIENT = 'insufficient'
+FAILED = 'failed'
+
+inserted_regexp = re.compile(r"^Inserted data for \[(.*) \(([a-f0-9]{24})\)\]: (\d+)")
+insufficient_regexp = re.compile(r"^Insufficient data for \[(.*)\]: (\d+)")
+
+
+class CrawlLedger:
+    def __init__(self, path='data/ledger.db'):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS people ("
+                          "name TEXT PRIMARY KEY, "
+                          "status TEXT NOT NULL, "
+                          "attempts INTEGER NOT NULL DEFAULT 0, "
+                          "length INTEGER, "
+                          "object_id TEXT, "
+                          "updated REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS people_status ON people (status)")
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM people").fetchone()[0]
+
+    def add_people(self, people):
+        cur = self.conn.executemany("INSERT OR IGNORE INTO people (name, status, updated) VALUES (?, ?, ?)",
+                                    ((p, PENDING, time.time()) for p in people))
+        self.conn.commit()
+        return cur.rowcount
+
+    def status(self, name):
+        row = self.conn.execute("SELECT status FROM people WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def pending(self):
+        # rowid follows insertion order, so a resumed run picks up where the previous one stopped
+        rows = self.conn.execute("SELECT name FROM people WHERE status IN (?, ?) ORDER BY rowid", (PENDING, FETCHED))
+        return [r[0] for r in rows]
+
+    def mark(self, name, status, length=None, object_id=None, attempt=False, commit=True):
+        self.conn.execute("INSERT INTO people (name, status, attempts, length, object_id, updated) "
+                          "VALUES (?, ?, ?, ?, ?, ?) "
+                          "ON CONFLICT(name) DO UPDATE SET status = excluded.status, "
+                          "attempts = attempts + ?, "
+                          "length = COALESCE(excluded.length, length), "
+                          "object_id = COALESCE(excluded.object_id, object_id), "
+                          "updated = excluded.updated",
+                          (name, status, int(attempt), length, object_id, time.time(), int(attempt)))
+        if commit:
+            self.conn.commit()
+
+    def requeue_failed(self):
+        cur = self.conn.execute("UPDATE people SET status = ?, updated = ? WHERE status = ?",
+                                (PENDING, time.time(), FAILED))
+        self.conn.commit()
+        return cur.rowcount
+
+    def reconcile(self, db):
+        # a run killed between fetch and insert leaves 'fetched' rows: check Mongo before re-queuing them
+        fetched = [r[0] for r in self.conn.execute("SELECT name FROM people WHERE status = ?", (FETCHED,))]
+        for name in fetched:
+            object_id = db.find_person(name)
+            if object_id is not None:
+                self.mark(name, INSERTED, object_id=str(object_id))
+            else:
+                self.mark(name, PENDING)
+        return len(fetched)
+
+    def import_logfile(self, logfile):
+        # seed the ledger from the print output of runs made before the ledger existed
+        n = 0
+        with open(logfile, 'r') as infile:
+            for line in infile:
+                match = inserted_regexp.match(line)
+                if match:
+                    self.mark(match.group(1), INSERTED, length=int(match.group(3)), object_id=match.group(2), commit=False)
+                    n += 1
+                    continue
+                match = insufficient_regexp.match(line)
+                if match:
+                    self.mark(match.group(1), INSUFFICIENT, length=int(match.group(2)), commit=False)
+                    n += 1
+        self.conn.commit()
+        return n
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM people GROUP BY status"))
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    ledger = CrawlLedger()
+    print(ledger.counts())
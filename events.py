@@ -0,0 +1,115 @@
+import warnings
+import numpy as np
+
+# event study: every (person, event) pair becomes one row of a people x relative-months matrix.
+# Inside the span a person's series covers, a missing month counts as 0 revisions; outside it, NaN.
+
+
+class EventWindows:
+    def __init__(self, matrix, ids, names, event_months, before, after):
+        self.matrix = matrix                # (events, before + 1 + after), column `before` is the event month
+        self.ids = ids
+        self.names = names
+        self.event_months = event_months
+        self.before = before
+        self.after = after
+
+    def __len__(self):
+        return len(self.matrix)
+
+    @property
+    def offsets(self):
+        return np.arange(-self.before, self.after + 1)
+
+    def columns(self, lo, hi):
+        # column slice for relative months lo..hi inclusive
+        return slice(lo + self.before, hi + self.before + 1)
+
+    def _check(self, window, what):
+        lo, hi = window
+        if lo > hi or lo < -self.before or hi > self.after:
+            raise ValueError("{} window {} is empty or outside the relative months {}..{}".format(
+                what, tuple(window), -self.before, self.after))
+
+    def stats(self, baseline=None, window=(0, 0), percentiles=(10, 25, 75, 90)):
+        # baseline: relative months averaged per person as the reference level (default: all months before);
+        # window: relative months of the reaction, compared with that baseline; with before=0 there are no months
+        # before the event, so the baseline must be given
+        baseline = baseline or (-self.before, -1)
+        self._check(baseline, 'baseline')
+        self._check(window, 'reaction')
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)        # all-NaN rows or columns
+            base = np.nanmean(self.matrix[:, self.columns(*baseline)], axis=1)
+            reaction = np.nanmean(self.matrix[:, self.columns(*window)], axis=1)
+            excess = reaction - base
+            log_uplift = np.log1p(reaction) - np.log1p(base)
+            ok = ~np.isnan(excess)
+            res = {'offsets': self.offsets,
+                   'count': np.sum(~np.isnan(self.matrix), axis=0),
+                   'mean': np.nanmean(self.matrix, axis=0),
+                   'median': np.nanmedian(self.matrix, axis=0),
+                   'percentiles': dict(zip(percentiles, np.nanpercentile(self.matrix, percentiles, axis=0))),
+                   'excess_profile': np.nanmean(self.matrix - base[:, None], axis=0),
+                   'baseline': base,
+                   'excess': excess,
+                   'log_uplift': log_uplift,
+                   'events': int(ok.sum()),
+                   'mean_excess': float(np.mean(excess[ok])) if ok.any() else np.nan,
+                   'median_excess': float(np.median(excess[ok])) if ok.any() else np.nan,
+                   'mean_uplift': float(np.expm1(np.mean(log_uplift[ok]))) if ok.any() else np.nan,
+                   'median_uplift': float(np.expm1(np.median(log_uplift[ok]))) if ok.any() else np.nan,
+                   'share_up': float(np.mean(excess[ok] > 0)) if ok.any() else np.nan}
+        return res
+
+    def top(self, n=20, **kwargs):
+        # events with the largest excess over their baseline
+        excess = self.stats(**kwargs)['excess']
+        order = np.argsort(np.where(np.isnan(excess), -np.inf, excess))[::-1][:n]
+        return [(self.ids[i], self.names[i], float(excess[i])) for i in order]
+
+
+def align(ragged, event_ids, event_months, before=12, after=12, keep_empty=False):
+    # one vectorized pass: the rows of every person with an event are expanded once per event
+    position = {object_id: i for i, object_id in enumerate(ragged.ids)}
+    found = np.array([object_id in position for object_id in event_ids], dtype=bool)
+    person = np.array([position[object_id] for object_id, f in zip(event_ids, found) if f], dtype=np.int64)
+    event_months = np.asarray(event_months, dtype=np.int64)[found]
+    sub = ragged.subset(person)
+    width = before + after + 1
+
+    first = ragged.months[sub.starts].astype(np.int64) if len(sub) else np.empty(0, dtype=np.int64)
+    last = ragged.months[sub.stops - 1].astype(np.int64) if len(sub) else np.empty(0, dtype=np.int64)
+    calendar = event_months[:, None] + np.arange(-before, after + 1)
+    matrix = np.where((calendar >= first[:, None]) & (calendar <= last[:, None]), 0.0, np.nan)
+
+    rows = sub._rows()
+    event = np.repeat(np.arange(len(sub)), sub.lengths)
+    rel = ragged.months[rows].astype(np.int64) - event_months[event] + before
+    keep = (rel >= 0) & (rel < width)
+    matrix[event[keep], rel[keep]] = ragged.values[rows[keep]]
+
+    ids, names = sub.ids, sub.names
+    if not keep_empty:
+        covered = ~np.all(np.isnan(matrix), axis=1)
+        matrix, ids, names, event_months = matrix[covered], ids[covered], names[covered], event_months[covered]
+    return EventWindows(matrix, ids, names, event_months, before, after)
+
+
+def event_study(store, db, event='death_date', column='num_rev', before=12, after=12):
+    from ragged import RaggedSeries
+    ids, months = db.event_months(event)
+    return align(RaggedSeries.from_store(store, column), ids, months, before, after)
+
+
+if __name__ == "__main__":
+    import sys
+    from mongodb_client import DB
+    from series_store import SeriesStore
+    event = sys.argv[1] if len(sys.argv) > 1 else 'death_date'
+    windows = event_study(SeriesStore(), DB(), event)
+    res = windows.stats()
+    print("{}: {} events, mean uplift {:.2f}x, median uplift {:.2f}x, {:.0%} above baseline".format(
+        event, res['events'], 1 + res['mean_uplift'], 1 + res['median_uplift'], res['share_up']))
+    for offset, mean, median in zip(res['offsets'], res['mean'], res['median']):
+        print("{:+4d}  mean {:10.1f}  median {:8.1f}".format(offset, mean, median))
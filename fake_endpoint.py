@@ -0,0 +1,128 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse, unquote
+
+import synthetic
+
+person_regexp = re.compile(r"<http://fr\.wikipedia\.org/wiki/([^>]*)>")
+cursor_regexp = re.compile(r'str\(\?person\) > "((?:[^"\\\\]|\\\\.)*)"')
+limit_regexp = re.compile(r"LIMIT (\d+)")
+since_regexp = re.compile(r"- 1 >= (\d+)\)")
+
+
+class FakeSparqlEndpoint:
+    # local stand-in for the dbpedia-historique endpoint, serving synthetic bindings
+    def __init__(self, people=None, months=120, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_status=500, host='127.0.0.1', port=0, seed=0):
+        self.people = people if people is not None else synthetic.make_people(100, seed)
+        self.months = months
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}/sparql".format(host, port)
+
+    def _handler(self):
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = parse_qs(urlparse(self.path).query)
+                self._answer(params.get('query', [''])[0])
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length).decode('utf-8')
+                params = parse_qs(body)
+                self._answer(params.get('query', [body])[0])
+
+            def _answer(self, query):
+                status, payload = endpoint.respond(query)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/sparql-results+json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def respond(self, query):
+        with self.lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            failing = self.random.random() < self.error_rate
+            if failing:
+                self.errors += 1
+        if delay:
+            time.sleep(delay)
+        if failing:
+            return self.error_status, b'Virtuoso 42000 Error: injected failure'
+        match = re.search(person_regexp, query)
+        if match:
+            result = synthetic.make_history(unquote(match.group(1)), months=self.months)
+            since = re.search(since_regexp, query)
+            if since:
+                result['results']['bindings'] = _since(result['results']['bindings'], int(since.group(1)))
+        else:
+            result = synthetic.make_people_result(self._people_page(query))
+        return 200, json.dumps(result).encode('utf-8')
+
+    def _people_page(self, query):
+        people = sorted(self.people, key=lambda p: 'http://fr.dbpedia.org/resource/{}'.format(p))
+        cursor = re.search(cursor_regexp, query)
+        if cursor:
+            after = cursor.group(1).replace('\\"', '"').replace('\\\\', '\\')
+            people = [p for p in people if 'http://fr.dbpedia.org/resource/{}'.format(p) > after]
+        limit = re.search(limit_regexp, query)
+        if limit:
+            people = people[:int(limit.group(1))]
+        return people
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _since(bindings, since):
+    # what the date FILTER of query_history_since keeps: dated nodes from the month key on, non-blank rows
+    keys = {}
+    for b in bindings:
+        if b.get('p2', {}).get('value') == synthetic.dc_date:
+            month, year = b['v2']['value'].split('/')
+            keys[b['v']['value']] = int(year) * 12 + int(month) - 1
+    return [b for b in bindings if b['v']['type'] != 'bnode' or keys.get(b['v']['value'], -1) >= since]
+
+
+if __name__ == "__main__":
+    endpoint = FakeSparqlEndpoint(latency=0.2, jitter=0.3, error_rate=0.05, port=8890)
+    print("Serving fake endpoint at {}".format(endpoint.url))
+    endpoint.server.serve_forever()
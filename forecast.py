@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import signal
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import utils
+
+# ARIMA orders come from the ACF/PACF stored by the analysis for the transform that made the series stationary:
+# 'ts' -> d = 0, 'ts_diff' -> d = 1, 'ts_log' -> fitted on the log of the series.
+# One fit per series, stored with a hash of its data and model, so unchanged series are never refit.
+
+transform_d = {'ts': 0, 'ts_diff': 1, 'ts_log': 0}
+
+
+class FitTimeout(Exception):
+    pass
+
+
+def select_order(acf, pacf, n, max_order=3):
+    # Box-Jenkins cut-off: p (q) is the number of leading PACF (ACF) lags outside the 95% band
+    bound = 1.96 / np.sqrt(n)
+
+    def leading(values):
+        k = 0
+        for v in values[1:max_order + 1]:       # lag 0 is always 1
+            if abs(v) < bound:
+                break
+            k += 1
+        return k
+    return leading(pacf), leading(acf)
+
+
+def fit_key(values, transform, order, holdout):
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    h.update(json.dumps([transform, list(order), holdout]).encode('utf-8'))
+    return h.hexdigest()
+
+
+class ForecastCache:
+    def __init__(self, path='results/forecast.db'):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        if 'key' in [r[1] for r in self.conn.execute("PRAGMA table_info(fits)")]:
+            self.conn.execute("DROP TABLE fits")        # keyed by content only: rebuilt, series are refit once
+        self.conn.execute("CREATE TABLE IF NOT EXISTS fits ("
+                          "object_id TEXT NOT NULL, "
+                          "column_name TEXT NOT NULL, "
+                          "hash TEXT NOT NULL, "
+                          "transform TEXT, "
+                          "p INTEGER, "
+                          "d INTEGER, "
+                          "q INTEGER, "
+                          "params TEXT, "
+                          "forecast TEXT, "
+                          "rmse REAL, "
+                          "naive_rmse REAL, "
+                          "seconds REAL, "
+                          "error TEXT, "
+                          "updated REAL, "
+                          "PRIMARY KEY (object_id, column_name))")
+        self.conn.commit()
+
+    def hashes(self, with_errors=True):
+        # (object id, column) -> fit_key of the data and model of its stored fit
+        sql = "SELECT object_id, column_name, hash FROM fits" + ("" if with_errors else " WHERE error IS NULL")
+        return {(r[0], r[1]): r[2] for r in self.conn.execute(sql)}
+
+    def put(self, results):
+        now = time.time()
+        self.conn.executemany("INSERT OR REPLACE INTO fits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              [(r['object_id'], r['column'], r['key'], r['transform'], r['order'][0],
+                                r['order'][1], r['order'][2],
+                                json.dumps(r['params']) if r.get('params') is not None else None,
+                                json.dumps(r['forecast']) if r.get('forecast') is not None else None,
+                                r.get('rmse'), r.get('naive_rmse'), r.get('seconds'), r.get('error'), now)
+                               for r in results])
+        self.conn.commit()
+
+    def summary(self):
+        # bulk holdout report per column and order
+        return list(self.conn.execute(
+            "SELECT column_name, transform, p, d, q, COUNT(*), AVG(rmse), AVG(rmse / naive_rmse), "
+            "SUM(rmse < naive_rmse) FROM fits WHERE error IS NULL AND naive_rmse > 0 "
+            "GROUP BY column_name, transform, p, d, q ORDER BY COUNT(*) DESC"))
+
+    def errors(self):
+        return list(self.conn.execute("SELECT error, COUNT(*) FROM fits WHERE error IS NOT NULL GROUP BY error"))
+
+    def close(self):
+        self.conn.close()
+
+
+def _on_alarm(signum, frame):
+    raise FitTimeout()
+
+
+def _init_worker():
+    import warnings
+    warnings.simplefilter('ignore')         # convergence warnings, one per fit
+    signal.signal(signal.SIGALRM, _on_alarm)
+
+
+def fit_one(task, timeout):
+    # holdout fit: train on all but the last `holdout` months, forecast them, compare with a naive forecast
+    from statsmodels.tsa.arima.model import ARIMA
+    res = {k: task[k] for k in ('key', 'object_id', 'column', 'transform', 'order')}
+    values = np.asarray(task['values'], dtype=np.float64)
+    train, test = values[:-task['holdout']], values[-task['holdout']:]
+    if task['transform'] == 'ts_log':
+        if np.any(train <= 0):
+            res['error'] = 'log of non-positive values'
+            return res
+        train = np.log(train)
+    start = time.perf_counter()
+    try:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+        fitted = ARIMA(train, order=task['order']).fit()
+        predicted = fitted.forecast(task['holdout'])
+    except FitTimeout:
+        res['error'] = 'timeout'
+        return res
+    except Exception as e:
+        res['error'] = type(e).__name__
+        return res
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    if task['transform'] == 'ts_log':
+        predicted = np.exp(predicted)
+    res['seconds'] = time.perf_counter() - start
+    res['params'] = [float(v) for v in fitted.params]
+    res['forecast'] = [float(v) for v in predicted]
+    res['rmse'] = float(utils.RMSE(np.asarray(predicted), test))
+    res['naive_rmse'] = float(utils.RMSE(np.full(len(test), values[-task['holdout'] - 1]), test))
+    return res
+
+
+def _fit_chunk(tasks, timeout):
+    return [fit_one(task, timeout) for task in tasks]
+
+
+class ForecastEngine:
+    def __init__(self, results, series, cache=None, holdout=12, max_order=3, min_length=60):
+        self.results = results          # ResultsStore with the ACF/PACF of the analysis
+        self.series = series            # SeriesStore
+        self.cache = cache or ForecastCache()
+        self.holdout = holdout
+        self.max_order = max_order
+        self.min_length = min_length
+
+    def plan(self, column=None, retry_errors=False):
+        # one task per analyzed series with stored ACF/PACF and no cached fit for its current data
+        done = self.cache.hashes(with_errors=not retry_errors)
+        tasks = []
+        cached = 0
+        for rec in self.results.stationarity(column=column):
+            if rec['acf'] is None or not rec['stationary'] or rec['transform'] not in transform_d:
+                continue
+            if rec['object_id'] not in self.series:
+                continue
+            _, values = self.series.series(rec['object_id'], rec['column_name'])
+            if len(values) < max(self.min_length, 2 * self.holdout):
+                continue
+            p, q = select_order(rec['acf'], rec['pacf'], rec['length'], self.max_order)
+            order = (p, transform_d[rec['transform']], q)
+            key = fit_key(values, rec['transform'], order, self.holdout)
+            if done.get((rec['object_id'], rec['column_name'])) == key:
+                cached += 1
+                continue
+            tasks.append({'key': key, 'object_id': rec['object_id'], 'column': rec['column_name'],
+                          'transform': rec['transform'], 'order': order, 'holdout': self.holdout,
+                          'values': np.array(values, dtype=np.float64)})
+        return tasks, cached
+
+    def run(self, column=None, workers=None, timeout=10.0, chunksize=20, retry_errors=False):
+        tasks, cached = self.plan(column, retry_errors)
+        chunks = [tasks[i:i + chunksize] for i in range(0, len(tasks), chunksize)]
+        summary = {'fitted': 0, 'failed': 0, 'cached': cached}
+        start = time.time()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = [pool.submit(_fit_chunk, chunk, timeout) for chunk in chunks]
+            for future in as_completed(futures):
+                results = future.result()
+                self.cache.put(results)
+                for r in results:
+                    summary['failed' if r.get('error') else 'fitted'] += 1
+                done = summary['fitted'] + summary['failed']
+                print("Fitted {}/{} series ({:.1f} fits/s)".format(done, len(tasks), done / (time.time() - start)))
+        summary['elapsed'] = time.time() - start
+        return summary
+
+
+def main(column=None, workers=None, timeout=10.0, holdout=12, retry_errors=False,
+         series_store='data/series_store'):
+    from results_store import ResultsStore
+    from series_store import SeriesStore
+    engine = ForecastEngine(ResultsStore(), SeriesStore(series_store), holdout=holdout)
+    summary = engine.run(column, workers=workers or os.cpu_count(), timeout=timeout, retry_errors=retry_errors)
+    print("{} fitted, {} failed, {} unchanged since the last run".format(summary['fitted'], summary['failed'],
+                                                                        summary['cached']))
+    for column, transform, p, d, q, n, rmse, ratio, better in engine.cache.summary():
+        print("{} {} ({},{},{}): {} series, RMSE {:.1f}, {:.2f}x naive, better than naive for {}".format(
+            column, transform, p, d, q, n, rmse, ratio, better))
+    for error, n in engine.cache.errors():
+        print("{}: {}".format(error, n))
+    engine.cache.close()
+    return summary
+
+
+if __name__ == "__main__":
+    import sys
+    main(retry_errors='--retry-errors' in sys.argv)
@@ -1,36 +1,94 @@
 import numpy as np
-import scipy.stats as stats
-import matplotlib.pyplot as plt
-from scipy.stats.kde import gaussian_kde
-import re
-
-
-def compute_stats(lengths):
-    with open('results/stats.txt', 'w') as out:
-        out.write("Min: {}\n".format(np.min(lengths)))
-        out.write("Max: {}\n".format(np.max(lengths)))
-        out.write("Mean: {}\n".format(np.mean(lengths)))
-        out.write("Std: {}\n".format(np.std(lengths)))
-        out.write("Median (50-tile): {}\n".format(np.percentile(lengths, 50)))   # median.
-        out.write("95-tile: {}\n".format(np.percentile(lengths, 95)))
-        out.write("zero-length: {}\n".format(lengths.count(0)))
-        out.write("95-length: {}\n".format(lengths.count(np.percentile(lengths, 95))))
-        out.write("max-length: {}\n".format(lengths.count(np.max(lengths))))
-
-
-def plot_distributions(logfile):
-    with open(logfile, 'r') as infile:
-        arr = infile.readlines()
-        lengths = [int(line.split(":")[1]) for line in arr[1:]]
-        lengths.sort()
+import json
+import os
+from itertools import chain
+from crawl_ledger import inserted_regexp, insufficient_regexp
+
+
+# oldest first: the printed output of the runs before the event log, then the event log
+default_logfiles = ['data/logfile.txt', 'data/events.jsonl']
+
+
+def scan_logfile(logfiles=None, larger_than=150):
+    # one pass over each logfile, one length per person (the latest entry wins, e.g. after --retry-failed),
+    # ids of the long series on the side; a logfile is either the JSON-lines event log of metrics.Metrics or the
+    # printed output of a run, where only the inserted/insufficient lines count
+    if logfiles is None:
+        logfiles = [f for f in default_logfiles if os.path.isfile(f)]
+    elif isinstance(logfiles, str):
+        logfiles = [logfiles]
+    latest = {}     # name -> (length, object id or None)
+    for logfile in logfiles:
+        with open(logfile, 'r') as infile:
+            first = next(infile, '')
+            lines = chain([first], infile)
+            latest.update(_scan_events(lines) if first.startswith('{') else _scan_lines(lines))
+    lengths = np.fromiter((l for l, _ in latest.values()), dtype=np.int64, count=len(latest))
+    longest = {object_id: l for l, object_id in latest.values() if l > larger_than and object_id is not None}
+    return lengths, longest
+
+
+def _scan_lines(lines):
+    for line in lines:
+        match = inserted_regexp.match(line)
+        if match is not None:
+            yield match.group(1), (int(match.group(3)), match.group(2))
+            continue
+        match = insufficient_regexp.match(line)
+        if match is not None:
+            yield match.group(1), (int(match.group(2)), None)
+
+
+def _scan_events(lines):
+    for line in lines:
+        record = json.loads(line)
+        if record['event'] in ('inserted', 'insufficient'):
+            yield record['name'], (record['length'], record.get('object_id'))
+
+
+def length_stats(lengths):
+    lengths = np.asarray(lengths)
+    if len(lengths) == 0:
+        return {}
+    median, p95 = np.percentile(lengths, [50, 95])
+    max_length = lengths.max()
+    return {'min': lengths.min(), 'max': max_length, 'mean': lengths.mean(), 'std': lengths.std(),
+            'median': median, 'p95': p95, 'zero': np.count_nonzero(lengths == 0),
+            '95_length': np.count_nonzero(lengths == p95), 'max_length': np.count_nonzero(lengths == max_length)}
+
+
+def compute_stats(lengths, fname='results/stats.txt'):
+    res = length_stats(lengths)
+    with open(fname, 'w') as out:
+        if not res:     # empty logfile, or an event log with failures only
+            out.write("No series\n")
+            return res
+        out.write("Min: {}\n".format(res['min']))
+        out.write("Max: {}\n".format(res['max']))
+        out.write("Mean: {}\n".format(res['mean']))
+        out.write("Std: {}\n".format(res['std']))
+        out.write("Median (50-tile): {}\n".format(res['median']))   # median.
+        out.write("95-tile: {}\n".format(res['p95']))
+        out.write("zero-length: {}\n".format(res['zero']))
+        out.write("95-length: {}\n".format(res['95_length']))
+        out.write("max-length: {}\n".format(res['max_length']))
+    return res
+
+
+def plot_distributions(logfiles=None, kde_method='binned'):
+    # scipy and matplotlib only load here, text parsing and stats stay light
+    import scipy.stats as stats
+    import matplotlib.pyplot as plt
+    from kde import make_kde
+    lengths = np.sort(scan_logfile(logfiles)[0])
     compute_stats(lengths)
     figname = './results/distributions.pdf'
     mu = np.mean(lengths)
     std = np.std(lengths)
     cdf = stats.norm.cdf(lengths, mu, std)
 
-    kde = gaussian_kde(lengths)
-    dist_space = np.linspace(min(lengths), max(lengths), 100)
+    kde = make_kde(lengths, method=kde_method)     # 'exact' for scipy's gaussian_kde
+    dist_space = np.linspace(lengths[0], lengths[-1], 100)
 
     fig, ax1 = plt.subplots()
     pdf_line = ax1.plot(dist_space, kde(dist_space), linestyle='dashed', label="pdf")
@@ -47,6 +105,8 @@ def plot_distributions(logfile):
 
 
 def plot_ratio_rev_contrib():
+    import scipy.stats as stats
+    import matplotlib.pyplot as plt
     fname = 'data/ratio_rev_contrib.txt'
     with open(fname, 'r') as infile:
         arr = infile.readlines()
@@ -64,23 +124,9 @@ def plot_ratio_rev_contrib():
     plt.close()
 
 
-def find_longest_ts(logfile, larger_than=150):
-    with open(logfile, 'r') as infile:
-        arr = infile.readlines()
-    res = {}
-    regexp = re.compile("[a-z0-9]{24}(?=\))")
-    for line in arr[1:]:
-        try:
-            l = int(line.split(":")[1])
-            if l > larger_than:
-                try:
-                    objid = re.search(regexp, line).group(0)
-                    res[objid] = l
-                except AttributeError as e:
-                    exit("Unable to process {} - {}".format(line, e))
-        except ValueError as e:
-            exit("Unable to process {} - {}".format(line, e))
-    return res
+def find_longest_ts(logfiles=None, larger_than=150):
+    return scan_logfile(logfiles, larger_than)[1]
+
 
 if __name__ == "__main__":
     logfile = 'data/logfile.txt'
@@ -90,6 +136,6 @@ if __name__ == "__main__":
     #     lengths.sort()
 
     # compute_stats(lengths)
-    plot_distributions(logfile)
+    plot_distributions()     # logfile.txt and the event log
     # plot_ratio_rev_contrib()
     # find_longest_ts(logfile)
\ No newline at end of file
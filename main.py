@@ -1,9 +1,9 @@
 #!/usr/bin/python3
 import os
-from sparqlclient import SparqlClient
+from sparql_client import SparqlClient
+from query_cache import QueryCache
 import re
 import pandas as pd
-import json
 import analysis
 from collections import defaultdict
 
@@ -38,14 +38,6 @@ def extract(dic, search_string):
     return extracted
 
 
-def execute_query(url, q, fname):
-    s = SparqlClient(url)
-    res = s.run_query(q)
-    with open(fname, 'w') as outfile:
-        json.dump(res, outfile)
-    return res
-
-
 def create_dataframe(dic, search_string_list):
     list_of_df = []
     for ss in search_string_list:
@@ -69,24 +61,12 @@ def analyze(df, keys):
             print(acf)
 
 if __name__ == "__main__":
-    import time
-    expire_time = 60 * 60 * 24 * 7  # 7 days
-    datafile = 'hillary_clinton.json'
-    if not os.path.isfile(datafile) or time.time() - os.stat(datafile).st_mtime > expire_time:
-        print("Querying URL")
-        q = """ SELECT DISTINCT * WHERE
-            {
-              <http://fr.wikipedia.org/wiki/Hillary_Clinton> ?p ?v .
-              OPTIONAL {?v ?p2 ?v2}
-            }
-            ORDER BY ?v
-            """
-        url = "http://dbpedia-historique.inria.fr/sparql"
-        res = execute_query(url, q, datafile)
-    else:
-        print("Querying Local")
-        with open(datafile) as infile:
-            res = json.load(infile)
+    url = "http://dbpedia-historique.inria.fr/sparql"
+    s = SparqlClient(url, cache=QueryCache('./data/cache', ttl=60 * 60 * 24 * 7))  # 7 days
+    res = s.get_history_per_person('Hillary_Clinton')
+    print("Cache: {}".format(s.cache.stats()))
+    if res is None:
+        exit("Problems loading data")
 
     if len(res.keys()) == 0:
         exit("Problems loading data")
@@ -0,0 +1,154 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# latency buckets: 1ms doubling up to ~2 minutes
+latency_bounds = [0.001 * 2 ** k for k in range(18)]
+
+
+class Histogram:
+    def __init__(self, bounds=latency_bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.n += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation, capped by the largest value seen
+        if self.n == 0:
+            return None
+        rank = q * self.n
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {'n': self.n, 'mean': self.total / self.n if self.n else None, 'min': self.min, 'max': self.max,
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99)}
+
+
+class Metrics:
+    # counters, latency histograms and a JSON-lines event log shared by the threads of one run
+    def __init__(self, event_log=None, progress_interval=10.0, name='acquire'):
+        self.name = name
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.progress_interval = progress_interval
+        self.last_progress = self.start
+        self.total = None
+        self.events = None
+        if event_log:
+            os.makedirs(os.path.dirname(event_log) or '.', exist_ok=True)
+            self.events = open(event_log, 'a', buffering=1)
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        with self.lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = Histogram()
+            hist.observe(value)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def event(self, event, **fields):
+        if self.events is None:
+            return
+        fields['event'] = event
+        fields['ts'] = time.time()
+        line = json.dumps(fields, default=str)
+        with self.lock:
+            self.events.write(line + "\n")
+
+    def snapshot(self):
+        with self.lock:
+            return {'elapsed': time.time() - self.start, 'counters': dict(self.counters),
+                    'histograms': {k: h.summary() for k, h in self.histograms.items()}}
+
+    def progress(self, done_counter='done', force=False):
+        # periodic progress line with rate and, when the total is known, ETA
+        now = time.time()
+        if not force and now - self.last_progress < self.progress_interval:
+            return
+        self.last_progress = now
+        snap = self.snapshot()
+        done = snap['counters'].get(done_counter, 0)
+        rate = done / snap['elapsed'] if snap['elapsed'] else 0.0
+        line = "[{}] {} done".format(self.name, done)
+        if self.total:
+            line += "/{}".format(self.total)
+        line += " ({:.1f}/s".format(rate)
+        if self.total and rate:
+            line += ", ETA {}".format(format_duration((self.total - done) / rate))
+        line += ")"
+        latency = snap['histograms'].get('sparql_latency')
+        if latency and latency['n']:
+            line += " sparql p50 {:.0f}ms p95 {:.0f}ms".format(latency['p50'] * 1000, latency['p95'] * 1000)
+        line += " {:.1f} MB received".format(snap['counters'].get('bytes_received', 0) / 2 ** 20)
+        print(line)
+        self.event('progress', **snap)
+
+    def close(self):
+        self.event('summary', **self.snapshot())
+        if self.events is not None:
+            self.events.close()
+            self.events = None
+
+
+class NullMetrics:
+    # default when no instrumentation is wanted
+    total = None
+
+    def incr(self, name, n=1):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+    @contextmanager
+    def timer(self, name):
+        yield
+
+    def event(self, event, **fields):
+        pass
+
+    def progress(self, done_counter='done', force=False):
+        pass
+
+    def close(self):
+        pass
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return "{}h{:02d}m".format(seconds // 3600, seconds % 3600 // 60)
+    if seconds >= 60:
+        return "{}m{:02d}s".format(seconds // 60, seconds % 60)
+    return "{}s".format(seconds)
@@ -0,0 +1,35 @@
+import pickle
+from pymongo import UpdateOne
+from mongodb_client import DB, person_document
+from person_page import PersonPage
+
+
+def migrate(db, batch_size=500):
+    # legacy documents are {'pickled': pickle.dumps(PersonPage.__dict__)}, the _id is kept
+    # so object ids already written to logfiles and results stay valid
+    ops = []
+    migrated = 0
+    for legacy in db.legacy.find({}, batch_size=batch_size):
+        doc = person_document(PersonPage.from_legacy(pickle.loads(legacy['pickled'])))
+        ops.append(UpdateOne({'name': doc['name']},
+                             {'$set': doc, '$setOnInsert': {'_id': legacy['_id']}},
+                             upsert=True))
+        if len(ops) >= batch_size:
+            db.people.bulk_write(ops, ordered=False)
+            migrated += len(ops)
+            ops = []
+            print("Migrated {} documents".format(migrated))
+    if ops:
+        db.people.bulk_write(ops, ordered=False)
+        migrated += len(ops)
+    return migrated
+
+
+if __name__ == "__main__":
+    import sys
+    d = DB()
+    n = migrate(d)
+    print("Migrated {} documents from {} to {}".format(n, d.legacy.name, d.people.name))
+    if '--drop-legacy' in sys.argv:
+        d.legacy.drop()
+        print("Dropped {}".format(d.legacy.name))
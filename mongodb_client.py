@@ -1,28 +1,254 @@
-import pickle
-from pymongo import MongoClient
+import datetime
+import time
+import numpy as np
+import pandas as pd
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from bson.binary import Binary
 from bson.objectid import ObjectId
+from person_page import day_to_datetime
+from metrics import NullMetrics
+
+# monthly series are stored as little-endian typed arrays, months counted from 1970-01
+series_dtypes = {'months': '<i4', 'num_rev': '<i8', 'size_rev': '<f8'}
+refresh_fields = ['birth_date', 'death_date', 'important_dates', 'unique_contributors']
+# changes whenever a refresh extends or rewrites a series, without reading the series itself
+fingerprint_fields = ['length', 'total_num_rev', 'total_size_rev']
+
+
+def to_months(index):
+    index = pd.DatetimeIndex(index)
+    return ((index.year - 1970) * 12 + index.month - 1).values.astype(np.int32)
+
+
+def month_to_datetime(month):
+    month = int(month)
+    return datetime.datetime(1970 + month // 12, month % 12 + 1, 1)
+
+
+def months_to_index(months):
+    return pd.DatetimeIndex(np.asarray(months, dtype=np.int64).astype('datetime64[M]').astype('datetime64[ns]'))
+
+
+def person_document(page):
+    # page: PersonPage, series already sorted by month
+    months, num_rev, size_rev = page.months, page.num_rev, page.size_rev
+    return {'name': page.name,
+            'birth_date': day_to_datetime(page.birth_date),
+            'death_date': day_to_datetime(page.death_date),
+            'important_dates': [day_to_datetime(d) for d in page.important_dates],
+            'unique_contributors': page.unique_contributors,
+            'length': len(months),
+            'first_month': month_to_datetime(months[0]) if len(months) else None,
+            'last_month': month_to_datetime(months[-1]) if len(months) else None,
+            'total_num_rev': int(num_rev.sum()),
+            'total_size_rev': float(size_rev.sum()),
+            'series': {k: Binary(np.ascontiguousarray(v, dtype=series_dtypes[k]).tobytes())
+                       for k, v in (('months', months), ('num_rev', num_rev), ('size_rev', size_rev))}}
+
+
+def series_fingerprint(doc):
+    return [int(doc['length']), int(doc['total_num_rev']), float(doc['total_size_rev'])]
+
+
+def decode_series(series):
+    return {k: np.frombuffer(series[k], dtype=dtype) for k, dtype in series_dtypes.items()}
+
+
+def decode_document(doc):
+    res = dict(doc)
+    if 'series' in res:
+        arrays = decode_series(res.pop('series'))
+        res['df'] = pd.DataFrame({'num_rev': arrays['num_rev'], 'size_rev': arrays['size_rev']},
+                                 index=months_to_index(arrays['months']))
+    return res
 
 
 class DB:
-    def __init__(self):
+    def __init__(self, name='webts'):
         self.client = MongoClient()
-        self.db = self.client.webts
-        self.people = self.db.people
+        self.db = self.client[name]
+        self.people = self.db.people_v2
+        self.legacy = self.db.people        # pickled PersonPage blobs, read only by migrate.py
+        self.people.create_index('name', unique=True)
+        self.people.create_index('length')
+        self.people.create_index('last_month')
+        self.people.create_index('unique_contributors')
+
+    def drop(self):
+        # removes the whole database, for throwaway ones such as the benchmark's
+        self.client.drop_database(self.db.name)
 
     def insert_person(self, personpage):
-        pickled = pickle.dumps(personpage.__dict__)
-        person_page_id = self.people.insert_one({'pickled': pickled}).inserted_id
-        return person_page_id
+        # upsert by name so a re-fetched person never produces a second document
+        match = self.people.find_one_and_update({'name': personpage.name},
+                                                {'$set': person_document(personpage)},
+                                                projection={'_id': 1},
+                                                upsert=True,
+                                                return_document=ReturnDocument.AFTER)
+        return match['_id']
+
+    def insert_many(self, personpages):
+        docs = [person_document(p) for p in personpages]
+        if not docs:
+            return []
+        res = self.people.bulk_write([UpdateOne({'name': d['name']}, {'$set': d}, upsert=True) for d in docs],
+                                     ordered=False)
+        if res.upserted_count == len(docs):
+            return [res.upserted_ids[i] for i in range(len(docs))]
+        # people already stored: one extra round-trip resolves every id by name, which does not depend on how
+        # the server numbers the upserts of a mixed batch
+        found = {d['name']: d['_id'] for d in self.people.find({'name': {'$in': [d['name'] for d in docs]}},
+                                                               projection={'name': 1})}
+        return [found[d['name']] for d in docs]
+
+    def merge_many(self, personpages):
+        # refresh: the months of each page replace or extend the stored series, metadata present in the page
+        # overwrites the stored one; returns the object id of each page written, None for the pages not written
+        # (people unchanged by the refresh, or not stored at all)
+        if not personpages:
+            return []
+        projection = dict.fromkeys(['name', 'series'] + refresh_fields, 1)
+        stored = {d['name']: d for d in self.people.find({'name': {'$in': [p.name for p in personpages]}},
+                                                         projection=projection)}
+        ops = []
+        ids = []
+        for page in personpages:
+            doc = stored.get(page.name)
+            if doc is None:
+                ids.append(None)
+                continue
+            arrays = decode_series(doc['series'])
+            keep = ~np.isin(arrays['months'], page.months)
+            page.add_series(np.concatenate([arrays['months'][keep], page.months]),
+                            np.concatenate([arrays['num_rev'][keep], page.num_rev]),
+                            np.concatenate([arrays['size_rev'][keep], page.size_rev]))
+            update = person_document(page)
+            for key in refresh_fields:
+                if update[key] is None or update[key] == []:
+                    del update[key]     # not in the delta, keep what is stored
+            unchanged = all(np.array_equal(arrays[k], getattr(page, k)) for k in series_dtypes) and \
+                all(update[k] == doc.get(k) for k in refresh_fields if k in update)
+            if unchanged:
+                ids.append(None)
+            else:
+                ops.append(UpdateOne({'_id': doc['_id']}, {'$set': update}))
+                ids.append(doc['_id'])
+        if ops:
+            self.people.bulk_write(ops, ordered=False)
+        return ids
+
+    def last_months(self):
+        # name -> last stored month (months since 1970-01), the starting point of a refresh
+        return {d['name']: int(to_months([d['last_month']])[0])
+                for d in self.people.find({'last_month': {'$ne': None}}, projection={'name': 1, 'last_month': 1})}
+
+    def event_months(self, event):
+        # object ids and months since 1970-01 of one event type: 'birth_date', 'death_date' or 'important_dates';
+        # a person has one row per important date
+        ids, dates = [], []
+        for d in self.people.find({event: {'$nin': [None, []]}}, projection={event: 1}):
+            values = d[event] if isinstance(d[event], list) else [d[event]]
+            for value in values:
+                if isinstance(value, datetime.datetime):
+                    ids.append(str(d['_id']))
+                    dates.append(value)
+        return ids, to_months(dates) if dates else np.empty(0, dtype=np.int32)
+
+    def find_person(self, name):
+        match = self.people.find_one({'name': name}, projection={'_id': 1})
+        return match['_id'] if match else None
 
     def get_all_inserted(self):
         return self.people.distinct('_id')
 
-    def get_document(self, object_id):
-        match = self.people.find_one({"_id": ObjectId(object_id)})
-        pickled = match['pickled']
-        res = pickle.loads(pickled)
+    def get_longer_than(self, length):
+        return {str(d['_id']): d['length'] for d in self.people.find({'length': {'$gt': length}},
+                                                                    projection={'length': 1})}
+
+    def fingerprints(self, ids=None, batch_size=5000):
+        # object id -> series_fingerprint, for everyone or for the given ids
+        projection = dict.fromkeys(fingerprint_fields, 1)
+        if ids is None:
+            return {str(d['_id']): series_fingerprint(d) for d in self.people.find({}, projection=projection)}
+        ids = [ObjectId(i) for i in ids]
+        res = {}
+        for i in range(0, len(ids), batch_size):
+            res.update((str(d['_id']), series_fingerprint(d))
+                       for d in self.people.find({'_id': {'$in': ids[i:i + batch_size]}}, projection=projection))
         return res
 
+    def get_document(self, object_id, projection=None):
+        match = self.people.find_one({"_id": ObjectId(object_id)}, projection=projection)
+        return decode_document(match)
+
+    def iter_documents(self, ids=None, batch_size=500, projection=None, query=None):
+        # one round-trip per batch; with ids, documents come back in the order requested
+        if ids is None:
+            for doc in self.people.find(query or {}, projection=projection, batch_size=batch_size):
+                yield decode_document(doc)
+            return
+        ids = [ObjectId(i) for i in ids]
+        for i in range(0, len(ids), batch_size):
+            chunk = ids[i:i + batch_size]
+            found = {doc['_id']: doc for doc in self.people.find({'_id': {'$in': chunk}}, projection=projection,
+                                                                 batch_size=batch_size)}
+            for object_id in chunk:
+                if object_id in found:
+                    yield decode_document(found[object_id])
+
+    def iter_series(self, ids=None, batch_size=500, fields=('name', 'length', 'total_num_rev', 'total_size_rev'),
+                    query=None):
+        # raw typed arrays, without building a DataFrame per person
+        projection = dict.fromkeys(fields + ('series',), 1)
+        if ids is None:
+            cursors = [self.people.find(query or {}, projection=projection, batch_size=batch_size)]
+        else:
+            ids = [ObjectId(i) for i in ids]
+            cursors = (self.people.find({'_id': {'$in': ids[i:i + batch_size]}}, projection=projection,
+                                        batch_size=batch_size) for i in range(0, len(ids), batch_size))
+        for cursor in cursors:
+            for doc in cursor:
+                doc.update(decode_series(doc.pop('series')))
+                yield doc
+
+
+class BufferedWriter:
+    def __init__(self, db, size=500, interval=5.0, on_flush=None, metrics=None, write=None):
+        self.db = db
+        self.write = write or db.insert_many        # db.merge_many when refreshing
+        self.metrics = metrics or NullMetrics()
+        self.size = size
+        self.interval = interval
+        self.on_flush = on_flush        # called with [(personpage, object_id), ...] once written
+        self.buffer = []
+        self.last_flush = time.time()
+
+    def add(self, personpage):
+        self.buffer.append(personpage)
+        if len(self.buffer) >= self.size:
+            self.flush()
+        else:
+            self.tick()
+
+    def tick(self):
+        if self.buffer and time.time() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        pages, self.buffer = self.buffer, []
+        self.last_flush = time.time()
+        with self.metrics.timer('mongo_insert'):
+            ids = self.write(pages)
+        if self.on_flush is not None and pages:
+            self.on_flush(list(zip(pages, ids)))
+        return ids
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
 
 if __name__ == "__main__":
     d = DB()
@@ -30,6 +256,3 @@ if __name__ == "__main__":
     _id = l[0]
     doc = d.get_document(_id)
     print(type(doc['df']))
-
-
-
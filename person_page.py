@@ -1,31 +1,148 @@
+import datetime
+import struct
+import numpy as np
+import pandas as pd
+
+NaT = np.datetime64('NaT', 'D')
+
+# to_bytes/from_bytes are a standalone binary form of a page (files, caches, inter-process queues); the pipeline
+# itself stores pages in MongoDB through mongodb_client.person_document
+# to_bytes layout, little-endian: header, utf-8 name, important dates (i8 epoch days, NaT = min int64),
+# then the months (i4, since 1970-01), num_rev (i8) and size_rev (f8) columns
+_magic = b'WPP1'
+_header = struct.Struct('<4sIqqqII')
+
+
+def to_day(value):
+    # datetime, Timestamp, datetime64 or 'YYYY-MM-DD' string to datetime64[D]; None or unparseable to NaT
+    if value is None or value is pd.NaT:
+        return NaT
+    if isinstance(value, str):
+        try:
+            return np.datetime64(value.strip()[:10], 'D')
+        except ValueError:
+            return NaT
+    if isinstance(value, pd.Timestamp):
+        value = value.to_datetime64()
+    try:
+        return np.datetime64(value, 'D')
+    except (ValueError, TypeError):
+        return NaT
+
+
+def day_to_datetime(day):
+    # datetime64[D] to datetime.datetime, None for NaT or years outside what datetime can hold
+    if np.isnat(day):
+        return None
+    d = day.astype(object)
+    if not isinstance(d, datetime.date):
+        return None
+    return datetime.datetime(d.year, d.month, d.day)
+
+
+def parse_months(values):
+    # 'MM/YYYY' strings to months since 1970-01
+    res = np.empty(len(values), dtype=np.int32)
+    for i, s in enumerate(values):
+        month, year = s.split('/')
+        res[i] = (int(year) - 1970) * 12 + int(month) - 1
+    return res
+
+
 class PersonPage:
+    __slots__ = ('name', 'birth_date', 'death_date', 'important_dates', 'unique_contributors',
+                 'months', 'num_rev', 'size_rev')
+
     def __init__(self, person):
         self.name = person
-        self.df = None
-        self.important_dates = []
-        self.birth_date = None
-        self.death_date = None
+        self.birth_date = NaT
+        self.death_date = NaT
+        self.important_dates = np.empty(0, dtype='datetime64[D]')
         self.unique_contributors = None
+        self.months = np.empty(0, dtype=np.int32)
+        self.num_rev = np.empty(0, dtype=np.int64)
+        self.size_rev = np.empty(0, dtype=np.float64)
 
     def add_birth_date(self, date):
-        self.birth_date = date
+        self.birth_date = to_day(date)
 
     def add_death_date(self, date):
-        self.death_date = date
+        self.death_date = to_day(date)
 
     def add_important_date(self, date):
-        self.important_dates.append(date)
+        self.important_dates = np.append(self.important_dates, to_day(date))
 
     def add_unique_contributors(self, num):
         self.unique_contributors = num
 
+    def add_series(self, months, num_rev, size_rev):
+        # months since 1970-01, kept sorted
+        months = np.asarray(months, dtype=np.int32)
+        order = np.argsort(months, kind='stable')
+        self.months = months[order]
+        self.num_rev = np.asarray(num_rev, dtype=np.int64)[order]
+        self.size_rev = np.asarray(size_rev, dtype=np.float64)[order]
+
     def add_dataframe(self, df):
-        self.df = df
+        if df is None or len(df) == 0:
+            self.add_series([], [], [])
+            return
+        index = pd.DatetimeIndex(df.index)
+        self.add_series((index.year - 1970) * 12 + index.month - 1, df['num_rev'].values, df['size_rev'].values)
+
+    @property
+    def df(self):
+        if len(self.months) == 0:
+            return pd.DataFrame.from_dict({})
+        index = pd.DatetimeIndex(self.months.astype(np.int64).astype('datetime64[M]').astype('datetime64[ns]'))
+        return pd.DataFrame({'num_rev': self.num_rev, 'size_rev': self.size_rev}, index=index)
+
+    def __len__(self):
+        return len(self.months)
+
+    def to_bytes(self):
+        name = self.name.encode('utf-8')
+        uc = -1 if self.unique_contributors is None else int(self.unique_contributors)
+        header = _header.pack(_magic, len(name), self.birth_date.astype(np.int64), self.death_date.astype(np.int64),
+                              uc, len(self.important_dates), len(self.months))
+        return b''.join([header, name, self.important_dates.astype('<i8').tobytes(),
+                         self.months.astype('<i4').tobytes(), self.num_rev.astype('<i8').tobytes(),
+                         self.size_rev.astype('<f8').tobytes()])
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, name_len, birth, death, uc, n_dates, n = _header.unpack_from(data)
+        if magic != _magic:
+            raise ValueError("Not a serialized PersonPage")
+        offset = _header.size
+        page = cls(bytes(data[offset:offset + name_len]).decode('utf-8'))
+        offset += name_len
+        page.birth_date = np.int64(birth).astype('datetime64[D]')
+        page.death_date = np.int64(death).astype('datetime64[D]')
+        page.unique_contributors = None if uc < 0 else uc
+        page.important_dates = np.frombuffer(data, '<i8', n_dates, offset).astype('datetime64[D]')
+        offset += 8 * n_dates
+        page.months = np.frombuffer(data, '<i4', n, offset)
+        page.num_rev = np.frombuffer(data, '<i8', n, offset + 4 * n)
+        page.size_rev = np.frombuffer(data, '<f8', n, offset + 12 * n)
+        return page
+
+    @classmethod
+    def from_legacy(cls, fields):
+        # unpickled __dict__ of the old PersonPage: DataFrame series, Timestamps or raw strings as dates
+        page = cls(fields['name'])
+        page.add_birth_date(fields.get('birth_date'))
+        page.add_death_date(fields.get('death_date'))
+        page.important_dates = np.array([to_day(d) for d in fields.get('important_dates') or []],
+                                        dtype='datetime64[D]')
+        page.add_unique_contributors(fields.get('unique_contributors'))
+        page.add_dataframe(fields.get('df'))
+        return page
 
     def __str__(self):
         s = "{} ({}-{})".format(self.name, self.birth_date, self.death_date)
-        if self.df:
-            s += "\nlen ts: {}".format(len(self.df))
+        if len(self):
+            s += "\nlen ts: {}".format(len(self))
         else:
             s += " (df empty)"
         return s
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+
+def _makedirs(fname):
+    os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
+
+
+class NullPlotter:
+    def ts(self, ts, title, fname, chain=None):
+        pass
+
+    def acf_pacf(self, lag_acf, lag_pacf, n, fname):
+        pass
+
+
+class SyncPlotter:
+    # renders inside the analysis loop, as before
+    def ts(self, ts, title, fname, chain=None):
+        # the rolling statistics come from the TransformChain of ts when given, and are only computed here
+        import utils
+        _makedirs(fname)
+        if chain is None:
+            utils.plot_ts(ts, title, fname)
+        else:
+            utils.plot_ts(ts, title, fname, rolmean=chain['rolmean'], rolstd=chain['rolstd'])
+
+    def acf_pacf(self, lag_acf, lag_pacf, n, fname):
+        import utils
+        _makedirs(fname)
+        utils.plot_acf_pacf(lag_acf, lag_pacf, n, fname)
+
+
+class PlotQueue:
+    # records what each figure needs into a spool directory, render_spool draws them later
+    def __init__(self, spool_dir='results/plot_spool'):
+        self.spool_dir = spool_dir
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def _spool(self, kind, fname, title='', **arrays):
+        h = hashlib.sha1()
+        for part in (kind, title, fname):
+            h.update(part.encode('utf-8'))
+        for key in sorted(arrays):
+            h.update(key.encode('utf-8'))
+            h.update(np.ascontiguousarray(arrays[key]).tobytes())
+        spec = os.path.join(self.spool_dir, hashlib.sha1(fname.encode('utf-8')).hexdigest() + '.npz')
+        tmp = spec + '.{}.tmp'.format(os.getpid())
+        with open(tmp, 'wb') as out:
+            np.savez(out, kind=np.array(kind), title=np.array(title), fname=np.array(fname),
+                     digest=np.array(h.hexdigest()), **arrays)
+        os.replace(tmp, spec)
+
+    def ts(self, ts, title, fname, chain=None):
+        # rolling statistics are redone at render time, only the series is spooled
+        self._spool('ts', fname, title, index=ts.index.values.astype('datetime64[ns]').astype(np.int64),
+                    values=np.asarray(ts.values, dtype=np.float64))
+
+    def acf_pacf(self, lag_acf, lag_pacf, n, fname):
+        self._spool('acf_pacf', fname, lag_acf=np.asarray(lag_acf, dtype=np.float64),
+                    lag_pacf=np.asarray(lag_pacf, dtype=np.float64), n=np.array(n))
+
+
+def make_plotter(mode, spool_dir='results/plot_spool'):
+    if mode == 'sync':
+        return SyncPlotter()
+    if mode == 'deferred':
+        return PlotQueue(spool_dir)
+    if mode in (None, 'none'):
+        return NullPlotter()
+    raise ValueError("Unknown plot mode {}".format(mode))
+
+
+def _init_renderer():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _render(spec):
+    import pandas as pd
+    import utils
+    with np.load(spec, allow_pickle=False) as f:
+        kind, fname = str(f['kind']), str(f['fname'])
+        _makedirs(fname)
+        if kind == 'ts':
+            ts = pd.Series(f['values'], index=pd.DatetimeIndex(f['index'].astype('datetime64[ns]')))
+            utils.plot_ts(ts, str(f['title']), fname)
+        else:
+            utils.plot_acf_pacf(f['lag_acf'], f['lag_pacf'], int(f['n']), fname)
+    return fname
+
+
+def render_spool(spool_dir='results/plot_spool', workers=None, force=False):
+    manifest_file = os.path.join(spool_dir, 'manifest.json')
+    manifest = {}
+    if os.path.isfile(manifest_file):
+        with open(manifest_file, 'r') as infile:
+            manifest = json.load(infile)
+    todo = {}
+    skipped = 0
+    for entry in os.listdir(spool_dir):
+        if not entry.endswith('.npz'):
+            continue
+        spec = os.path.join(spool_dir, entry)
+        with np.load(spec, allow_pickle=False) as f:
+            fname, digest = str(f['fname']), str(f['digest'])
+        if not force and manifest.get(fname) == digest and os.path.isfile(fname):
+            skipped += 1        # inputs unchanged since the last render
+            continue
+        todo[spec] = (fname, digest)
+    rendered = 0
+    failed = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_renderer) as pool:
+        futures = {pool.submit(_render, spec): spec for spec in todo}
+        for future in as_completed(futures):
+            fname, digest = todo[futures[future]]
+            try:
+                future.result()
+            except Exception as e:
+                failed[fname] = repr(e)
+                continue
+            manifest[fname] = digest
+            rendered += 1
+    tmp = manifest_file + '.tmp'
+    with open(tmp, 'w') as out:
+        json.dump(manifest, out)
+    os.replace(tmp, manifest_file)
+    return {'rendered': rendered, 'skipped': skipped, 'failed': failed}
+
+
+if __name__ == "__main__":
+    import sys
+    res = render_spool(force='--force' in sys.argv)
+    print("Rendered {} figures, {} unchanged, {} failed".format(res['rendered'], res['skipped'], len(res['failed'])))
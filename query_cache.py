@@ -0,0 +1,116 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class QueryCache:
+    def __init__(self, path='data/cache', ttl=60 * 60 * 24 * 7, max_bytes=4 * 1024 ** 3, compresslevel=6):
+        self.path = path
+        self.ttl = ttl                  # seconds, None = never expires
+        self.max_bytes = max_bytes
+        self.compresslevel = compresslevel
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        os.makedirs(path, exist_ok=True)
+        self.size = sum(os.path.getsize(f) for f in self._files())
+
+    @staticmethod
+    def normalize(query):
+        return " ".join(query.split())
+
+    def _key(self, query):
+        return hashlib.sha1(self.normalize(query).encode('utf-8')).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + '.json.gz')
+
+    def _files(self):
+        for root, _, files in os.walk(self.path):
+            for f in files:
+                if f.endswith('.json.gz'):
+                    yield os.path.join(root, f)
+
+    def _count(self, attr):
+        with self.lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def get(self, query):
+        fname = self._file(self._key(query))
+        try:
+            with gzip.open(fname, 'rt', encoding='utf-8') as infile:
+                entry = json.load(infile)
+        except (OSError, ValueError):
+            self._count('misses')
+            return None
+        if entry['query'] != self.normalize(query):
+            self._count('misses')
+            return None
+        if self.ttl is not None and time.time() - entry['created'] > self.ttl:
+            self._remove(fname)
+            self._count('expired')
+            self._count('misses')
+            return None
+        # mtime doubles as last-access time for LRU eviction, creation time lives in the entry
+        os.utime(fname)
+        self._count('hits')
+        return entry['result']
+
+    def put(self, query, result):
+        fname = self._file(self._key(query))
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        entry = {'query': self.normalize(query), 'created': time.time(), 'result': result}
+        tmp = "{}.{}.tmp".format(fname, threading.get_ident())
+        with gzip.open(tmp, 'wt', encoding='utf-8', compresslevel=self.compresslevel) as out:
+            json.dump(entry, out)
+        old = os.path.getsize(fname) if os.path.isfile(fname) else 0
+        os.replace(tmp, fname)
+        with self.lock:
+            self.size += os.path.getsize(fname) - old
+            over = self.size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _remove(self, fname):
+        try:
+            size = os.path.getsize(fname)
+            os.remove(fname)
+        except OSError:
+            return
+        with self.lock:
+            self.size -= size
+
+    def evict(self, low_water=0.9):
+        # drop least recently used entries down to low_water * max_bytes so eviction is amortized
+        with self.lock:
+            entries = sorted((os.stat(f).st_mtime, f) for f in self._files())
+            target = self.max_bytes * low_water
+            for _, fname in entries:
+                if self.size <= target:
+                    break
+                try:
+                    size = os.path.getsize(fname)
+                    os.remove(fname)
+                except OSError:
+                    continue
+                self.size -= size
+                self.evictions += 1
+
+    def clear(self):
+        for fname in list(self._files()):
+            self._remove(fname)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'expired': self.expired,
+                    'evictions': self.evictions, 'bytes': self.size}
+
+
+if __name__ == "__main__":
+    c = QueryCache()
+    print(c.stats())
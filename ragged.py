@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+from mongodb_client import months_to_index
+
+
+class RaggedSeries:
+    # many series of different lengths in one values buffer and one int32 months buffer;
+    # series i is values[starts[i]:stops[i]], a view, and subsets share the buffers
+    def __init__(self, values, months, starts, stops, ids=None, names=None):
+        self.values = values
+        self.months = months
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.stops = np.asarray(stops, dtype=np.int64)
+        self.ids = np.asarray(ids if ids is not None else np.arange(len(self.starts)).astype(str), dtype=object)
+        self.names = np.asarray(names if names is not None else self.ids, dtype=object)
+
+    @classmethod
+    def from_arrays(cls, arrays, months=None, ids=None, names=None):
+        lengths = np.array([len(a) for a in arrays], dtype=np.int64)
+        stops = np.cumsum(lengths)
+        values = np.concatenate(arrays) if len(arrays) else np.empty(0)
+        if months is None:
+            months = np.concatenate([np.arange(n, dtype=np.int32) for n in lengths]) if len(arrays) \
+                else np.empty(0, dtype=np.int32)
+        else:
+            months = np.concatenate(months).astype(np.int32) if len(arrays) else np.empty(0, dtype=np.int32)
+        return cls(values, months, stops - lengths, stops, ids, names)
+
+    @classmethod
+    def from_store(cls, store, column='num_rev', mmap=True):
+        # zero-copy over the memory-mapped columns of a SeriesStore; mmap=False loads them into memory
+        values, months = store.column(column), store.column('months')
+        if not mmap:
+            values, months = np.array(values), np.array(months)
+        return cls(values, months, store.starts, store.stops, store.ids, store.names)
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def lengths(self):
+        return self.stops - self.starts
+
+    def __getitem__(self, i):
+        return self.values[self.starts[i]:self.stops[i]]
+
+    def __iter__(self):
+        for lo, hi in zip(self.starts, self.stops):
+            yield self.values[lo:hi]
+
+    def month_range(self, i):
+        return self.months[self.starts[i]:self.stops[i]]
+
+    def series(self, i):
+        # pandas view of one series, for plotting and the per-series analysis
+        return pd.Series(self[i], index=months_to_index(self.month_range(i)), name=self.names[i])
+
+    def subset(self, idx):
+        return RaggedSeries(self.values, self.months, self.starts[idx], self.stops[idx], self.ids[idx],
+                            self.names[idx])
+
+    def longer_than(self, length):
+        return self.subset(np.flatnonzero(self.lengths > length))
+
+    def take(self, idx, n):
+        # first n values of the series idx, as a (len(idx), n) float64 matrix
+        rows = self.starts[idx][:, None] + np.arange(n)
+        return np.asarray(self.values[rows.ravel()], dtype=np.float64).reshape(len(idx), n)
+
+    def _rows(self):
+        # buffer positions of every value, series after series
+        lengths = self.lengths
+        first = np.cumsum(lengths) - lengths
+        return np.arange(int(lengths.sum())) - np.repeat(first - self.starts, lengths)
+
+    def padded(self, fill=np.nan):
+        # left-aligned (len, max length) matrix and the lengths, the input layout of batch_stationarity
+        lengths = self.lengths
+        out = np.full((len(self), int(lengths.max()) if len(self) else 0), fill, dtype=np.float64)
+        out[np.arange(out.shape[1]) < lengths[:, None]] = self.values[self._rows()]
+        return out, lengths
+
+    def nbytes(self):
+        return self.values.nbytes + self.months.nbytes + self.starts.nbytes + self.stops.nbytes
+
+
+if __name__ == "__main__":
+    import time
+    from series_store import SeriesStore
+    start = time.perf_counter()
+    ragged = RaggedSeries.from_store(SeriesStore(), 'num_rev')
+    print("Loaded {} series, {} months in {:.2f}s, {:.1f} MB".format(len(ragged), int(ragged.lengths.sum()),
+                                                                    time.perf_counter() - start,
+                                                                    ragged.nbytes() / 2 ** 20))
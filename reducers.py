@@ -0,0 +1,102 @@
+import os
+
+
+class Reducer:
+    # collection-wide metric computed in Analyzer.scan: declare the fields needed, fold documents one by one;
+    # close() always runs after the scan, also when it fails
+    name = None
+    fields = ()
+
+    def update(self, doc):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class RatioRevContrib(Reducer):
+    name = 'ratio_rev_contrib'
+    fields = ('total_num_rev', 'unique_contributors')
+
+    def __init__(self, fname='data/ratio_rev_contrib.txt'):
+        self.fname = fname
+        self.tmp = fname + '.tmp'
+        self.out = None     # streamed to disk, nothing kept per person; opened on the first document
+        self.n = 0
+
+    def update(self, doc):
+        if not doc.get('unique_contributors'):
+            return
+        if self.out is None:
+            self.out = open(self.tmp, 'w')
+        ratio = float(doc['total_num_rev'] / doc['unique_contributors'])
+        self.out.write("{}\n".format(str((doc['_id'], ratio))))
+        self.n += 1
+
+    def result(self):
+        # the previous file is only replaced by a complete scan
+        if self.out is None:
+            self.out = open(self.tmp, 'w')
+        self.out.close()
+        self.out = None
+        os.replace(self.tmp, self.fname)
+        return self.n
+
+    def close(self):
+        if self.out is not None:        # scan interrupted: drop the partial file
+            self.out.close()
+            self.out = None
+            os.remove(self.tmp)
+
+
+class LastUpdate(Reducer):
+    name = 'last_update'
+    fields = ('last_month',)
+
+    def __init__(self):
+        self.max_date = None
+
+    def update(self, doc):
+        last = doc.get('last_month')
+        if last is not None and (self.max_date is None or last > self.max_date):
+            self.max_date = last
+
+    def result(self):
+        return self.max_date
+
+
+class LengthHistogram(Reducer):
+    name = 'length_histogram'
+    fields = ('length',)
+
+    def __init__(self, bin_width=12):
+        self.bin_width = bin_width
+        self.counts = {}
+
+    def update(self, doc):
+        b = doc['length'] // self.bin_width * self.bin_width
+        self.counts[b] = self.counts.get(b, 0) + 1
+
+    def result(self):
+        return sorted(self.counts.items())
+
+
+class Totals(Reducer):
+    name = 'totals'
+    fields = ('length', 'total_num_rev', 'total_size_rev', 'unique_contributors')
+
+    def __init__(self):
+        self.totals = {'people': 0, 'months': 0, 'num_rev': 0, 'size_rev': 0.0, 'unique_contributors': 0}
+
+    def update(self, doc):
+        self.totals['people'] += 1
+        self.totals['months'] += doc['length']
+        self.totals['num_rev'] += doc['total_num_rev']
+        self.totals['size_rev'] += doc['total_size_rev']
+        self.totals['unique_contributors'] += doc.get('unique_contributors') or 0
+
+    def result(self):
+        return self.totals
@@ -0,0 +1,129 @@
+import json
+import os
+import sqlite3
+import time
+
+stationarity_columns = ['object_id', 'name', 'column_name', 'transform', 'length', 'adf_stat', 'p_value',
+                        'used_lag', 'nobs', 'crit_1', 'crit_5', 'crit_10', 'ic_best', 'stationary',
+                        'acf', 'pacf', 'updated']
+
+
+class ResultsStore:
+    def __init__(self, path='results/analysis.db'):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS stationarity ("
+                          "object_id TEXT NOT NULL, "
+                          "name TEXT, "
+                          "column_name TEXT NOT NULL, "
+                          "transform TEXT NOT NULL, "
+                          "length INTEGER, "
+                          "adf_stat REAL, "
+                          "p_value REAL, "
+                          "used_lag INTEGER, "
+                          "nobs INTEGER, "
+                          "crit_1 REAL, "
+                          "crit_5 REAL, "
+                          "crit_10 REAL, "
+                          "ic_best REAL, "
+                          "stationary INTEGER, "
+                          "acf TEXT, "
+                          "pacf TEXT, "
+                          "updated REAL, "
+                          "PRIMARY KEY (object_id, column_name, transform))")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS failures ("
+                          "object_id TEXT NOT NULL, "
+                          "column_name TEXT NOT NULL, "
+                          "error TEXT, "
+                          "updated REAL, "
+                          "PRIMARY KEY (object_id, column_name))")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS analyzed ("
+                          "object_id TEXT PRIMARY KEY, "
+                          "name TEXT, "
+                          "fingerprint TEXT, "
+                          "updated REAL)")
+        if 'fingerprint' not in [r[1] for r in self.conn.execute("PRAGMA table_info(analyzed)")]:
+            # tables from before fingerprints: their people are analyzed once more
+            self.conn.execute("ALTER TABLE analyzed ADD COLUMN fingerprint TEXT")
+        self.conn.commit()
+
+    def upsert_records(self, records, commit=True):
+        now = time.time()
+        rows = []
+        for r in records:
+            rows.append((r['object_id'], r['name'], r['column'], r['transform'], r['length'], r['adf_stat'],
+                         r['p_value'], r['used_lag'], r['nobs'], r['crit_1'], r['crit_5'], r['crit_10'],
+                         r['ic_best'], int(r['stationary']),
+                         json.dumps(r['acf']) if r.get('acf') is not None else None,
+                         json.dumps(r['pacf']) if r.get('pacf') is not None else None,
+                         now))
+        self.conn.executemany("INSERT OR REPLACE INTO stationarity ({}) VALUES ({})".format(
+            ", ".join(stationarity_columns), ", ".join("?" * len(stationarity_columns))), rows)
+        if commit:
+            self.conn.commit()
+
+    def add_failure(self, object_id, column, error, commit=True):
+        self.conn.execute("INSERT OR REPLACE INTO failures (object_id, column_name, error, updated) "
+                          "VALUES (?, ?, ?, ?)", (str(object_id), column or '', error, time.time()))
+        if commit:
+            self.conn.commit()
+
+    def mark_analyzed(self, object_id, name=None, fingerprint=None, commit=True):
+        self.conn.execute("INSERT OR REPLACE INTO analyzed (object_id, name, fingerprint, updated) "
+                          "VALUES (?, ?, ?, ?)", (str(object_id), name,
+                                                  json.dumps(fingerprint) if fingerprint is not None else None,
+                                                  time.time()))
+        if commit:
+            self.conn.commit()
+
+    def clear(self, object_id, records=True, commit=True):
+        # previous failures and, with records, the analysis rows of one person before it is stored again;
+        # the batched screen keeps its own rows
+        self.conn.execute("DELETE FROM failures WHERE object_id = ?", (str(object_id),))
+        if records:
+            self.conn.execute("DELETE FROM stationarity WHERE object_id = ? AND transform != 'ts_screen'",
+                              (str(object_id),))
+        if commit:
+            self.conn.commit()
+
+    def commit(self):
+        self.conn.commit()
+
+    def analyzed(self):
+        # object id -> series fingerprint at analysis time (None when not recorded)
+        return {r[0]: json.loads(r[1]) if r[1] else None
+                for r in self.conn.execute("SELECT object_id, fingerprint FROM analyzed")}
+
+    def stationarity(self, column=None, transform=None, object_id=None):
+        clauses, params = [], []
+        for field, value in (('column_name', column), ('transform', transform), ('object_id', object_id)):
+            if value is not None:
+                clauses.append("{} = ?".format(field))
+                params.append(str(value))
+        sql = "SELECT {} FROM stationarity".format(", ".join(stationarity_columns))
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        for row in self.conn.execute(sql, params):
+            res = dict(zip(stationarity_columns, row))
+            res['stationary'] = bool(res['stationary'])
+            res['acf'] = json.loads(res['acf']) if res['acf'] else None
+            res['pacf'] = json.loads(res['pacf']) if res['pacf'] else None
+            yield res
+
+    def failures(self):
+        return list(self.conn.execute("SELECT object_id, column_name, error FROM failures"))
+
+    def summary(self):
+        return list(self.conn.execute("SELECT column_name, transform, COUNT(*), SUM(stationary) "
+                                      "FROM stationarity GROUP BY column_name, transform"))
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    store = ResultsStore()
+    for column, transform, n, stationary in store.summary():
+        print("{} {}: {} series, {} stationary".format(column, transform, n, stationary))
+    print("{} failures".format(len(store.failures())))
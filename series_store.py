@@ -0,0 +1,179 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from mongodb_client import series_dtypes, months_to_index, to_months, series_fingerprint
+
+# every person's monthly series in three append-only column files (months since 1970-01, num_rev, size_rev),
+# located through index.json; a re-synced person is appended again and its old rows become garbage until compact()
+columns = ('months', 'num_rev', 'size_rev')
+
+
+def _month(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return int(to_months([pd.Timestamp(value)])[0])
+
+
+class SeriesStore:
+    def __init__(self, path='data/series_store'):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.index_file = os.path.join(path, 'index.json')
+        index = {'ids': [], 'names': [], 'starts': [], 'stops': [], 'fingerprints': []}
+        if os.path.isfile(self.index_file):
+            with open(self.index_file, 'r') as infile:
+                index = json.load(infile)
+        self.ids = index['ids']
+        self.names = index['names']
+        self.starts = np.asarray(index['starts'], dtype=np.int64)
+        self.stops = np.asarray(index['stops'], dtype=np.int64)
+        self.fingerprints = index['fingerprints']
+        # committed rows per column file; anything past it was written by an interrupted sync
+        self.rows = int(index.get('rows', self.stops.max() if len(self.stops) else 0))
+        self._positions()
+        self._maps = {}
+
+    def _positions(self):
+        self.position = {object_id: i for i, object_id in enumerate(self.ids)}
+        self.position.update({name: i for i, name in enumerate(self.names)})
+
+    def _file(self, column):
+        return os.path.join(self.path, '{}.bin'.format(column))
+
+    def column(self, column):
+        # committed rows of a column file, memory-mapped read-only
+        if column not in self._maps:
+            dtype = np.dtype(series_dtypes[column])
+            if self.rows == 0:
+                self._maps[column] = np.empty(0, dtype=dtype)
+            else:
+                self._maps[column] = np.memmap(self._file(column), dtype=dtype, mode='r', shape=(self.rows,))
+        return self._maps[column]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, person):
+        return str(person) in self.position
+
+    def lengths(self):
+        return self.stops - self.starts
+
+    def _slice(self, person, start=None, end=None):
+        i = self.position[str(person)]
+        lo, hi = int(self.starts[i]), int(self.stops[i])
+        if start is not None or end is not None:
+            months = self.column('months')[lo:hi]
+            if start is not None:
+                lo += int(np.searchsorted(months, _month(start), side='left'))
+            if end is not None:
+                hi = self.starts[i] + int(np.searchsorted(months, _month(end), side='right'))
+        return lo, int(hi)
+
+    def series(self, person, column='num_rev', start=None, end=None):
+        # (months, values) views into the column files; person is an object id or a name, end is inclusive
+        lo, hi = self._slice(person, start, end)
+        return self.column('months')[lo:hi], self.column(column)[lo:hi]
+
+    def frame(self, person, columns=('num_rev', 'size_rev'), start=None, end=None):
+        lo, hi = self._slice(person, start, end)
+        return pd.DataFrame({c: np.asarray(self.column(c)[lo:hi]) for c in columns},
+                            index=months_to_index(self.column('months')[lo:hi]))
+
+    def _live(self, column):
+        data = self.column(column)
+        if self.garbage() == 0:
+            return data[:int(self.stops.max())] if len(self.stops) else data[:0]
+        return np.concatenate([data[lo:hi] for lo, hi in zip(self.starts, self.stops)])
+
+    def monthly_totals(self, column='num_rev', start=None, end=None):
+        # sum over all people per calendar month, one bincount over the live rows
+        months = self._live('months')
+        values = self._live(column)
+        if len(months) == 0:
+            return pd.Series(dtype=np.float64)
+        lo = months.min() if start is None else _month(start)
+        hi = months.max() if end is None else _month(end)
+        keep = (months >= lo) & (months <= hi)
+        totals = np.bincount(months[keep] - lo, weights=values[keep], minlength=hi - lo + 1)
+        return pd.Series(totals, index=months_to_index(np.arange(lo, hi + 1)), name=column)
+
+    def garbage(self):
+        return self.rows - int(self.lengths().sum())
+
+    def sync(self, db, batch_size=500):
+        # appends people that are new or whose series changed since the last sync
+        stale = [object_id for object_id, fingerprint in db.fingerprints().items()
+                 if object_id not in self.position or self.fingerprints[self.position[object_id]] != fingerprint]
+        if not stale:
+            return 0
+        self._maps = {}
+        files = {}
+        for c in columns:
+            files[c] = open(self._file(c), 'ab')
+            files[c].truncate(self.rows * np.dtype(series_dtypes[c]).itemsize)    # rows of an interrupted sync
+        offset = self.rows
+        starts, stops = list(self.starts), list(self.stops)
+        try:
+            for doc in db.iter_series(stale, batch_size=batch_size):
+                for c in columns:
+                    files[c].write(doc[c].tobytes())
+                object_id = str(doc['_id'])
+                entry = (doc['name'], offset, offset + len(doc['months']), series_fingerprint(doc))
+                if object_id in self.position:
+                    i = self.position[object_id]
+                    self.names[i], starts[i], stops[i], self.fingerprints[i] = entry
+                else:
+                    self.position[object_id] = len(self.ids)
+                    self.ids.append(object_id)
+                    self.names.append(entry[0])
+                    starts.append(entry[1])
+                    stops.append(entry[2])
+                    self.fingerprints.append(entry[3])
+                offset = entry[2]
+        finally:
+            for f in files.values():
+                f.close()
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.stops = np.asarray(stops, dtype=np.int64)
+        self.rows = offset
+        self._positions()
+        self._write_index()     # data first, index last: a crash leaves rows past self.rows, dropped next time
+        return len(stale)
+
+    def compact(self):
+        # rewrites the live rows contiguously, in index order
+        if self.garbage() == 0:
+            return 0
+        dropped = self.garbage()
+        live = {c: self._live(c) for c in columns}
+        self._maps = {}
+        for c in columns:
+            tmp = self._file(c) + '.tmp'
+            live[c].tofile(tmp)
+            os.replace(tmp, self._file(c))
+        lengths = self.lengths()
+        self.stops = np.cumsum(lengths)
+        self.starts = self.stops - lengths
+        self.rows = int(lengths.sum())
+        self._write_index()
+        return dropped
+
+    def _write_index(self):
+        tmp = self.index_file + '.tmp'
+        with open(tmp, 'w') as out:
+            json.dump({'ids': self.ids, 'names': self.names, 'starts': self.starts.tolist(),
+                       'stops': self.stops.tolist(), 'fingerprints': self.fingerprints, 'rows': self.rows}, out)
+        os.replace(tmp, self.index_file)
+
+
+if __name__ == "__main__":
+    from mongodb_client import DB
+    store = SeriesStore()
+    print("Synced {} people".format(store.sync(DB())))
+    print("{} people, {} months stored, {} garbage rows".format(len(store), int(store.lengths().sum()),
+                                                               store.garbage()))
+    print(store.monthly_totals('num_rev').tail(12))
@@ -0,0 +1,187 @@
+import json
+import os
+import numpy as np
+from ragged import RaggedSeries
+
+# people are compared on a common calendar window: each series is laid out month by month (no revision = 0),
+# optionally log1p-scaled, reduced to segment means (PAA) and z-normalized, so that the squared euclidean
+# distance between two feature vectors is 2 * dim * (1 - correlation of their PAA shapes)
+
+
+def paa_features(ragged, start, end, segment=6, log=True, chunk=10000):
+    # (len(ragged), dim) float32 features and a validity mask (False for people flat over the window)
+    ncal = end - start + 1
+    dim = -(-ncal // segment)
+    features = np.zeros((len(ragged), dim), dtype=np.float32)
+    valid = np.zeros(len(ragged), dtype=bool)
+    for lo in range(0, len(ragged), chunk):
+        part = ragged.subset(np.arange(lo, min(lo + chunk, len(ragged))))
+        rows = part._rows()
+        person = np.repeat(np.arange(len(part)), part.lengths)
+        pos = ragged.months[rows].astype(np.int64) - start
+        keep = (pos >= 0) & (pos < ncal)
+        values = np.asarray(ragged.values[rows][keep], dtype=np.float64)
+        if log:
+            values = np.log1p(np.maximum(values, 0))
+        dense = np.bincount(person[keep] * (dim * segment) + pos[keep], weights=values,
+                            minlength=len(part) * dim * segment).reshape(len(part), dim, segment)
+        paa = dense.sum(axis=2)
+        paa[:, -1] *= segment / float(ncal - (dim - 1) * segment)      # the last segment may be shorter
+        paa /= segment
+        mean = paa.mean(axis=1, keepdims=True)
+        std = paa.std(axis=1, keepdims=True)
+        ok = std[:, 0] > 0
+        paa = np.where(ok[:, None], (paa - mean) / np.where(std > 0, std, 1), 0)
+        features[lo:lo + len(part)] = paa
+        valid[lo:lo + len(part)] = ok
+    return features, valid
+
+
+class SimilarityIndex:
+    # exact k-NN over the PAA features with one matrix-vector product per query
+    def __init__(self, start, end, segment=6, column='num_rev', log=True, extend=True):
+        self.start = int(start)
+        self.segment = segment
+        self.column = column
+        self.log = log
+        self.extend = extend        # move the window end to the latest stored month on sync
+        self._reset(end)
+
+    def _reset(self, end):
+        self.end = int(end)
+        self.dim = -(-(self.end - self.start + 1) // self.segment)
+        self._features = np.zeros((0, self.dim), dtype=np.float32)
+        self.size = 0
+        self.ids = []
+        self.names = []
+        self.position = {}
+        self.fingerprints = {}      # object id -> SeriesStore fingerprint at indexing time
+
+    @property
+    def features(self):
+        return self._features[:self.size]
+
+    @classmethod
+    def from_store(cls, store, column='num_rev', segment=6, log=True, start=None, end=None):
+        # calendar window defaults to the months covered by the store; without an explicit end it follows the
+        # latest stored month
+        months = store.column('months')
+        index = cls(months.min() if start is None else start, months.max() if end is None else end,
+                    segment, column, log, extend=end is None)
+        index.sync(store)
+        return index
+
+    def sync(self, store):
+        # indexes the people of a SeriesStore that are new or were refreshed since the last sync; when the store
+        # has months past the window end, the window is extended and everyone is indexed again, since the
+        # features are normalized over the whole window (without extend, those months are ignored)
+        months = store.column('months')
+        if self.extend and len(months) and int(months.max()) > self.end:
+            self._reset(months.max())
+        ragged = RaggedSeries.from_store(store, self.column)
+        stale = np.array([i for i, object_id in enumerate(store.ids)
+                          if self.fingerprints.get(object_id) != store.fingerprints[i]], dtype=np.int64)
+        if len(stale) == 0:
+            return 0
+        added = self.add(ragged.subset(stale))
+        self.fingerprints.update((store.ids[i], store.fingerprints[i]) for i in stale)
+        return added
+
+    def add(self, ragged):
+        # people already indexed are replaced in place, flat ones are skipped
+        features, valid = paa_features(ragged, self.start, self.end, self.segment, self.log)
+        added = 0
+        for i in np.flatnonzero(valid):
+            object_id = str(ragged.ids[i])
+            row = self.position.get(object_id)
+            if row is None:
+                row = self._append_row()
+                self.position[object_id] = row
+                self.ids.append(object_id)
+                self.names.append(str(ragged.names[i]))
+                added += 1
+            self._features[row] = features[i]
+        return added
+
+    def _append_row(self):
+        if self.size == len(self._features):       # amortized growth
+            grown = np.zeros((max(1024, 2 * len(self._features)), self.dim), dtype=np.float32)
+            grown[:self.size] = self._features[:self.size]
+            self._features = grown
+        self.size += 1
+        return self.size - 1
+
+    def vector(self, person):
+        return self.features[self.position[str(person)]]
+
+    def query(self, target, k=10, exclude_self=True):
+        # target: an indexed object id, or a feature vector; returns [(object_id, name, distance)]
+        if isinstance(target, str):
+            own = self.position[target]
+            target = self.features[own]
+        else:
+            own = None
+        distances = np.maximum(2 * self.dim - 2 * (self.features @ np.asarray(target, dtype=np.float32)), 0)
+        if exclude_self and own is not None:
+            distances[own] = np.inf
+        k = min(k, len(distances))
+        best = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+        best = best[np.argsort(distances[best])]
+        return [(self.ids[i], self.names[i], float(np.sqrt(distances[i]))) for i in best
+                if np.isfinite(distances[i])]
+
+    def query_many(self, targets, k=10):
+        # batched queries, one (len(targets), size) matrix product
+        queries = self.features[[self.position[str(t)] for t in targets]]
+        distances = np.maximum(2 * self.dim - 2 * (queries @ self.features.T), 0)
+        distances[np.arange(len(targets)), [self.position[str(t)] for t in targets]] = np.inf
+        k = min(k, self.size - 1)
+        best = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        order = np.take_along_axis(distances, best, axis=1).argsort(axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        return [[(self.ids[i], self.names[i], float(np.sqrt(row[i]))) for i in b]
+                for b, row in zip(best, distances)]
+
+    def save(self, path='data/similarity'):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'features.npy'), self.features)
+        tmp = os.path.join(path, 'index.json.tmp')
+        with open(tmp, 'w') as out:
+            json.dump({'start': self.start, 'end': self.end, 'segment': self.segment, 'column': self.column,
+                       'log': self.log, 'extend': self.extend, 'ids': self.ids, 'names': self.names,
+                       'fingerprints': self.fingerprints}, out)
+        os.replace(tmp, os.path.join(path, 'index.json'))
+
+    @classmethod
+    def load(cls, path='data/similarity'):
+        with open(os.path.join(path, 'index.json'), 'r') as infile:
+            meta = json.load(infile)
+        index = cls(meta['start'], meta['end'], meta['segment'], meta['column'], meta['log'], meta.get('extend', True))
+        index._features = np.load(os.path.join(path, 'features.npy'))
+        index.size = len(index._features)
+        index.ids = meta['ids']
+        index.names = meta['names']
+        index.position = {object_id: i for i, object_id in enumerate(index.ids)}
+        index.fingerprints = meta['fingerprints']
+        return index
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from series_store import SeriesStore
+    store = SeriesStore()
+    if os.path.isfile('data/similarity/index.json'):
+        index = SimilarityIndex.load()
+        print("Indexed {} new people".format(index.sync(store)))
+    else:
+        index = SimilarityIndex.from_store(store)
+    index.save()
+    print("{} people indexed, {} features".format(index.size, index.dim))
+    for person in sys.argv[1:]:
+        person = store.ids[store.position[person]]
+        start = time.perf_counter()
+        res = index.query(person)
+        print("{} ({:.1f} ms)".format(person, (time.perf_counter() - start) * 1000))
+        for object_id, name, distance in res:
+            print("  {:.3f} {} ({})".format(distance, name, object_id))
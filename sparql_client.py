@@ -1,46 +1,183 @@
+import json
+import os
+import queue
+import random
+import socket
+import threading
+import time
 from SPARQLWrapper import SPARQLWrapper, JSON
 from SPARQLWrapper.SPARQLExceptions import EndPointInternalError
-from urllib.error import HTTPError
+from urllib.error import HTTPError, URLError
+from metrics import NullMetrics
 
-query_all_person = """
+# keyset pagination: deep OFFSETs are both slow and capped on the endpoint
+query_people_page = """
     PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
     PREFIX type: <http://dbpedia.org/class/yago/>
     PREFIX prop: <http://dbpedia.org/ontology/>
 
-    SELECT DISTINCT * WHERE {
+    SELECT DISTINCT ?person WHERE {
         ?person a dbpedia-owl:Person
+        FILTER (str(?person) > "%s")
     }
+    ORDER BY str(?person)
+    LIMIT %d
     """
 
 query_history = "SELECT DISTINCT * WHERE {<http://fr.wikipedia.org/wiki/%s> ?p ?v . OPTIONAL {?v ?p2 ?v2} } ORDER BY ?v"
 
+# same rows as query_history, but only the monthly nodes dated ("MM/YYYY") from month key year * 12 + month - 1 on;
+# the non-blank rows (contributors, birth/death dates) always come along
+query_history_since = """
+    PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
+    SELECT DISTINCT ?p ?v ?p2 ?v2 WHERE {
+        { <http://fr.wikipedia.org/wiki/%(person)s> ?p ?v .
+          ?v <http://purl.org/dc/element/1.1/date> ?d .
+          ?v ?p2 ?v2 .
+          FILTER (xsd:integer(SUBSTR(str(?d), 4, 4)) * 12 + xsd:integer(SUBSTR(str(?d), 1, 2)) - 1 >= %(since)d) }
+        UNION
+        { <http://fr.wikipedia.org/wiki/%(person)s> ?p ?v .
+          FILTER (!isBlank(?v))
+          OPTIONAL {?v ?p2 ?v2} }
+    }
+    ORDER BY ?v
+    """
+
+default_url = "http://dbpedia-historique.inria.fr/sparql"
+
+# HTTPError is a URLError; socket.timeout covers read timeouts set via setTimeout
+retriable_errors = (EndPointInternalError, URLError, socket.timeout)
+
 
 class SparqlClient:
-    def __init__(self, url="http://dbpedia-historique.inria.fr/sparql"):
+    def __init__(self, url=default_url, timeout=None, retries=0, backoff=1.0, cache=None, metrics=None):
         self.sparql = SPARQLWrapper(url)
+        self.url = url
+        self.timeout = timeout
+        self.cache = cache
+        self.metrics = metrics or NullMetrics()
+        if timeout:
+            self.sparql.setTimeout(timeout)
+        self.retries = retries
+        self.backoff = backoff
 
-    def get_history_per_person(self, person, format=JSON):
+    def _query(self, query, format=JSON):
+        self.sparql.setQuery(query)
+        self.sparql.setReturnFormat(format)
+        with self.metrics.timer('sparql_latency'):
+            result = self.sparql.query()
+            if format != JSON:
+                return result.convert()
+            raw = result.response.read()        # read here rather than in convert() to count the bytes
+        self.metrics.incr('sparql_requests')
+        self.metrics.incr('bytes_received', len(raw))
+        return json.loads(raw.decode('utf-8'))
+
+    def _query_with_retry(self, query, format=JSON):
+        cached = self.cache is not None and format == JSON
+        if cached:
+            res = self.cache.get(query)
+            if res is not None:
+                self.metrics.incr('cache_hits')
+                return res
+        attempt = 0
+        while True:
+            try:
+                res = self._query(query, format)
+                if cached:
+                    self.cache.put(query, res)
+                return res
+            except retriable_errors:
+                self.metrics.incr('sparql_errors')
+                if attempt >= self.retries:
+                    raise
+                self.metrics.incr('sparql_retries')
+                time.sleep(self.backoff * 2 ** attempt + random.uniform(0, self.backoff))
+                attempt += 1
+
+    def get_history_per_person(self, person, format=JSON, since=None):
+        # since: month key (year * 12 + month - 1) of the oldest month to fetch, None for the whole history
+        query = query_history % person if since is None else query_history_since % {'person': person,
+                                                                                       'since': since}
         try:
-            self.sparql.setQuery(query_history % person)
-            self.sparql.setReturnFormat(format)
-            return self.sparql.query().convert()
+            return self._query_with_retry(query, format)
         except HTTPError as e:
             print("HTTPError {}  ({}) ".format(person, e))
             return None
         except EndPointInternalError as e:
             print("EndpointInternalError {}  ({}) ".format(person, e))
             return None
+        except (URLError, socket.timeout) as e:
+            print("Timeout {}  ({}) ".format(person, e))
+            return None
 
-    def get_all_people(self, format=JSON):
-        people = []
-        self.sparql.setQuery(query_all_person)
-        self.sparql.setReturnFormat(format)
-        res = self.sparql.query().convert()
-        for el in res['results']['bindings']:
-            url = el['person']['value']
-            person = url.split("/")[-1]
-            people.append(person)
-        return people
+    def _fetch_pages(self, cursor, page_size, pages, stop):
+        # runs in the prefetch thread, with its own SPARQLWrapper
+        client = SparqlClient(self.url, timeout=self.timeout, retries=self.retries, backoff=self.backoff,
+                              metrics=self.metrics)
+        item = None
+        try:
+            while not stop.is_set():
+                escaped = cursor.replace('\\', '\\\\').replace('"', '\\"')
+                res = client._query_with_retry(query_people_page % (escaped, page_size))
+                urls = [el['person']['value'] for el in res['results']['bindings']]
+                if not urls:
+                    break
+                cursor = urls[-1]
+                _put(pages, ([url.split("/")[-1] for url in urls], cursor), stop)
+                if len(urls) < page_size:
+                    break
+        except Exception as e:
+            item = e
+        _put(pages, item, stop)
+
+    def iter_people_pages(self, page_size=10000, cursor_file=None, prefetch=2):
+        cursor = ''
+        if cursor_file and os.path.isfile(cursor_file):
+            with open(cursor_file, 'r') as infile:
+                cursor = infile.read().strip()
+        pages = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._fetch_pages, args=(cursor, page_size, pages, stop), daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = pages.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                people, cursor = item
+                yield people
+                # the consumer came back for more: the page is processed, persist the cursor
+                if cursor_file:
+                    _write_cursor(cursor_file, cursor)
+        finally:
+            stop.set()
+
+    def iter_people(self, page_size=10000, cursor_file=None):
+        for page in self.iter_people_pages(page_size, cursor_file):
+            for person in page:
+                yield person
+
+    def get_all_people(self, page_size=10000):
+        return list(self.iter_people(page_size))
+
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=1)
+            return
+        except queue.Full:
+            continue
+
+
+def _write_cursor(cursor_file, cursor):
+    tmp = cursor_file + '.tmp'
+    with open(tmp, 'w') as out:
+        out.write(cursor)
+    os.replace(tmp, cursor_file)
 
 
 if __name__ == "__main__":
@@ -50,5 +187,3 @@ if __name__ == "__main__":
     person = people[0]
     res = s.get_history_per_person(person)
     print(res)
-
-
@@ -0,0 +1,71 @@
+import random
+
+voc = 'http://ns.inria.fr/dbpediafr/voc#'
+dc_date = 'http://purl.org/dc/element/1.1/date'
+rdf_value = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#value'
+primary_topic = 'http://xmlns.com/foaf/0.1/primaryTopic'
+dbo = 'http://dbpedia.org/ontology/'
+
+
+def _uri(value):
+    return {'type': 'uri', 'value': value}
+
+
+def _literal(value):
+    return {'type': 'literal', 'value': str(value)}
+
+
+def _bnode(value):
+    return {'type': 'bnode', 'value': value}
+
+
+def make_people(n, seed=0):
+    rnd = random.Random(seed)
+    return ["Person_{}_{}".format(i, rnd.randint(0, 10 ** 6)) for i in range(n)]
+
+
+def make_history_bindings(person, months=120, start_year=2003, seed=None):
+    # mirrors the layout of query_history: <page> ?p ?v . OPTIONAL {?v ?p2 ?v2}
+    rnd = random.Random(person if seed is None else seed)
+    bindings = []
+    resource = 'http://fr.dbpedia.org/resource/{}'.format(person)
+    birth = '{}-{:02d}-{:02d}+02:00'.format(rnd.randint(1900, 1990), rnd.randint(1, 12), rnd.randint(1, 28))
+    bindings.append({'p': _uri(primary_topic), 'v': _uri(resource),
+                     'p2': _uri(dbo + 'birthDate'), 'v2': _literal(birth)})
+    if rnd.random() < 0.3:
+        death = '{}-{:02d}-{:02d}+02:00'.format(rnd.randint(1991, 2016), rnd.randint(1, 12), rnd.randint(1, 28))
+        bindings.append({'p': _uri(primary_topic), 'v': _uri(resource),
+                         'p2': _uri(dbo + 'deathDate'), 'v2': _literal(death)})
+    bindings.append({'p': _uri(voc + 'uniqueContributorNb'), 'v': _literal(rnd.randint(1, 5000))})
+
+    node = 0
+    level = rnd.uniform(1, 50)
+    for m in range(months):
+        month = '{:02d}/{}'.format(m % 12 + 1, start_year + m // 12)
+        level = max(0.0, level + rnd.gauss(0, 3))
+        rev_node = 'nodeID://b{}'.format(10000 + node)
+        size_node = 'nodeID://b{}'.format(10001 + node)
+        node += 2
+        bindings.append({'p': _uri(voc + 'revPerMonth'), 'v': _bnode(rev_node),
+                         'p2': _uri(rdf_value), 'v2': _literal(int(level))})
+        bindings.append({'p': _uri(voc + 'revPerMonth'), 'v': _bnode(rev_node),
+                         'p2': _uri(dc_date), 'v2': _literal(month)})
+        bindings.append({'p': _uri(voc + 'averageSizePerMonth'), 'v': _bnode(size_node),
+                         'p2': _uri(rdf_value), 'v2': _literal(round(rnd.uniform(100, 90000), 2))})
+        bindings.append({'p': _uri(voc + 'averageSizePerMonth'), 'v': _bnode(size_node),
+                         'p2': _uri(dc_date), 'v2': _literal(month)})
+    bindings.sort(key=lambda b: b['v']['value'])     # ORDER BY ?v
+    return bindings
+
+
+def make_history(person, months=120, start_year=2003, seed=None):
+    return {'head': {'link': [], 'vars': ['p', 'v', 'p2', 'v2']},
+            'results': {'distinct': True, 'ordered': True,
+                        'bindings': make_history_bindings(person, months, start_year, seed)}}
+
+
+def make_people_result(people):
+    return {'head': {'link': [], 'vars': ['person']},
+            'results': {'distinct': True, 'ordered': True,
+                        'bindings': [{'person': _uri('http://fr.dbpedia.org/resource/{}'.format(p))}
+                                     for p in people]}}
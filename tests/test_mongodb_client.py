@@ -0,0 +1,91 @@
+import time
+import numpy as np
+import pytest
+from bson.objectid import ObjectId
+
+mongomock = pytest.importorskip('mongomock')
+
+import mongodb_client
+from mongodb_client import DB, BufferedWriter
+from person_page import PersonPage
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(mongodb_client, 'MongoClient', mongomock.MongoClient)
+    return DB('webts_test')
+
+
+def make_page(name, n=24, first=400, scale=1):
+    page = PersonPage(name)
+    page.add_series(np.arange(first, first + n), np.arange(n) * scale, np.linspace(0, 1, n) * scale)
+    return page
+
+
+def test_insert_many_returns_ids_in_order(db):
+    pages = [make_page('Person_{}'.format(i), n=10 + i) for i in range(5)]
+    ids = db.insert_many(pages)
+    assert len(ids) == 5 and len(set(ids)) == 5
+    for page, object_id in zip(pages, ids):
+        assert db.people.find_one({'_id': object_id})['name'] == page.name
+    assert db.insert_many([]) == []
+
+
+def test_insert_many_upserts_by_name(db):
+    first = db.insert_many([make_page('A'), make_page('B')])
+    again = db.insert_many([make_page('B', n=30), make_page('C')])
+    assert again[0] == first[1]
+    assert db.people.count_documents({}) == 3
+    assert db.people.find_one({'name': 'B'})['length'] == 30
+
+
+def test_buffered_writer_flushes_on_size(db):
+    flushed = []
+    writer = BufferedWriter(db, size=3, interval=3600, on_flush=flushed.append)
+    for i in range(7):
+        writer.add(make_page('P{}'.format(i)))
+    assert [len(batch) for batch in flushed] == [3, 3]
+    assert db.people.count_documents({}) == 6
+    writer.flush()
+    assert [len(batch) for batch in flushed] == [3, 3, 1]
+    for page, object_id in (pair for batch in flushed for pair in batch):
+        assert db.people.find_one({'_id': object_id})['name'] == page.name
+
+
+def test_buffered_writer_flushes_on_interval(db):
+    writer = BufferedWriter(db, size=100, interval=0.05)
+    writer.add(make_page('A'))
+    assert db.people.count_documents({}) == 0
+    time.sleep(0.06)
+    writer.tick()
+    assert db.people.count_documents({}) == 1
+
+
+def test_buffered_writer_context_flushes_rest(db):
+    with BufferedWriter(db, size=100, interval=3600) as writer:
+        writer.add(make_page('A'))
+        writer.add(make_page('B'))
+    assert db.people.count_documents({}) == 2
+
+
+def test_iter_documents_keeps_requested_order(db):
+    ids = db.insert_many([make_page('P{}'.format(i), n=5 + i) for i in range(10)])
+    wanted = ids[::-1][:7]
+    docs = list(db.iter_documents(wanted, batch_size=3))
+    assert [d['_id'] for d in docs] == wanted
+    assert [len(d['df']) for d in docs] == [14, 13, 12, 11, 10, 9, 8]
+
+
+def test_iter_documents_skips_missing_ids(db):
+    ids = db.insert_many([make_page('A'), make_page('B')])
+    docs = list(db.iter_documents([ids[0], ObjectId(), ids[1]]))
+    assert [d['name'] for d in docs] == ['A', 'B']
+
+
+def test_iter_documents_projection(db):
+    db.insert_many([make_page('A', scale=2)])
+    doc = next(db.iter_documents(projection={'name': 1, 'length': 1}))
+    assert set(doc) == {'_id', 'name', 'length'}
+    doc = next(db.iter_documents(projection={'name': 1, 'series': 1}))
+    assert list(doc['df']['num_rev']) == list(np.arange(24) * 2)
+    assert doc['df'].index[0].year == 2003 and doc['df'].index[0].month == 5
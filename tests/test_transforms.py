@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils
+from transforms import TransformChain
+
+
+def make_ts(n=120, seed=0):
+    rnd = np.random.RandomState(seed)
+    index = pd.date_range('2005-01-01', periods=n, freq='MS')
+    return pd.Series(np.exp(np.cumsum(rnd.normal(0.01, 0.1, n))) * 100, index=index)
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    counts = {}
+
+    def counting(name):
+        original = getattr(utils, name)
+
+        def wrapper(*args, **kwargs):
+            counts[name] = counts.get(name, 0) + 1
+            return original(*args, **kwargs)
+        monkeypatch.setattr(utils, name, wrapper)
+    for name in ('differentiate', 'log_transform', 'rolling_mean_std', 'adf', 'find_acf_pacf'):
+        counting(name)
+    return counts
+
+
+def test_derived_series(calls):
+    ts = make_ts()
+    chain = TransformChain(ts)
+    assert chain['ts'] is ts
+    pd.testing.assert_series_equal(chain['ts_diff'], ts.diff().dropna())
+    pd.testing.assert_series_equal(chain['ts_log'], np.log(ts))
+    pd.testing.assert_series_equal(chain['ts_log_diff'], np.log(ts).diff().dropna())
+    pd.testing.assert_series_equal(chain['rolmean'], ts.rolling(12).mean())
+    pd.testing.assert_series_equal(chain['rolstd'], ts.rolling(12).std())
+    with pytest.raises(KeyError):
+        chain['unknown']
+
+
+def test_each_result_computed_once(calls):
+    chain = TransformChain(make_ts())
+    for _ in range(3):
+        chain['ts_diff']
+        chain['ts_log_diff']
+        chain['rolmean']
+        chain['rolstd']
+        chain.adf('ts_diff')
+        chain.stationary('ts_diff')
+        chain.acf_pacf('ts_log')
+    # ts_diff and ts_log_diff, ts_log once (shared by ts_log_diff), one rolling pass for mean and std
+    assert calls == {'differentiate': 2, 'log_transform': 1, 'rolling_mean_std': 1, 'adf': 1, 'find_acf_pacf': 1}
+    assert chain.adf('ts_diff') is chain.adf('ts_diff')
+
+
+def test_ndarray_input():
+    x = make_ts().values
+    chain = TransformChain(x)
+    assert isinstance(chain['ts_diff'], np.ndarray)
+    np.testing.assert_allclose(chain['ts_diff'], np.diff(x))
+    np.testing.assert_allclose(chain['rolmean'][11:], pd.Series(x).rolling(12).mean().values[11:])
+
+
+def test_log_branch_uses_log_series(monkeypatch):
+    mongomock = pytest.importorskip('mongomock')
+    import mongodb_client
+    import analysis
+    monkeypatch.setattr(mongodb_client, 'MongoClient', mongomock.MongoClient)
+    # neither the series nor its difference is stationary, so the analysis falls through to the log branch
+    monkeypatch.setattr(TransformChain, 'stationary', lambda self, name='ts': name == 'ts_log')
+    ts = make_ts()
+    doc = {'_id': 'abc', 'name': 'A', 'important_dates': [], 'df': pd.DataFrame({'num_rev': ts})}
+    records, failed = analysis.Analyzer('none').analyze_document(doc)
+    assert failed == []
+    assert [r['transform'] for r in records] == ['ts', 'ts_diff', 'ts_log']
+    log_rec = records[-1]
+    expected = utils.adf(np.log(ts))
+    assert log_rec['adf_stat'] == pytest.approx(expected[0])
+    assert log_rec['length'] == len(ts)
+    lag_acf, lag_pacf = utils.find_acf_pacf(np.log(ts))
+    np.testing.assert_allclose(log_rec['acf'], lag_acf)
+    np.testing.assert_allclose(log_rec['pacf'], lag_pacf)
+    assert records[0]['acf'] is None and records[1]['acf'] is None
+
+
+def test_rolling_stats_only_for_sync_plots(monkeypatch, calls):
+    mongomock = pytest.importorskip('mongomock')
+    import mongodb_client
+    import analysis
+    monkeypatch.setattr(mongodb_client, 'MongoClient', mongomock.MongoClient)
+    doc = {'_id': 'abc', 'name': 'A', 'important_dates': [], 'df': pd.DataFrame({'num_rev': make_ts()})}
+    analysis.Analyzer('none').analyze_document(doc)
+    assert 'rolling_mean_std' not in calls
@@ -0,0 +1,42 @@
+import utils
+
+
+class TransformChain:
+    # derived series of one time series and their test results, each computed at most once
+    def __init__(self, ts, window=12, nlags=12):
+        self.ts = ts
+        self.window = window
+        self.nlags = nlags
+        self._series = {'ts': ts}
+        self._adf = {}
+        self._acf_pacf = {}
+
+    def _build(self, name):
+        if name == 'ts_diff':
+            return utils.differentiate(self.ts)
+        if name == 'ts_log':
+            return utils.log_transform(self.ts)
+        if name == 'ts_log_diff':
+            return utils.differentiate(self['ts_log'])
+        if name in ('rolmean', 'rolstd'):
+            self._series['rolmean'], self._series['rolstd'] = utils.rolling_mean_std(self.ts, self.window)
+            return self._series[name]
+        raise KeyError(name)
+
+    def __getitem__(self, name):
+        if name not in self._series:
+            self._series[name] = self._build(name)
+        return self._series[name]
+
+    def adf(self, name='ts'):
+        if name not in self._adf:
+            self._adf[name] = utils.adf(self[name])
+        return self._adf[name]
+
+    def stationary(self, name='ts'):
+        return utils.stationary(self.adf(name))
+
+    def acf_pacf(self, name='ts'):
+        if name not in self._acf_pacf:
+            self._acf_pacf[name] = utils.find_acf_pacf(self[name], nlags=self.nlags)
+        return self._acf_pacf[name]
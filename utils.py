@@ -1,15 +1,33 @@
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from statsmodels.tsa.stattools import adfuller, acf, pacf
-import statsmodels.tsa.api as smt
-import seaborn as sns
-sns.set(style='ticks', context='talk')
 
+# pandas, matplotlib/seaborn and statsmodels are imported on first use: they dominate startup time
+_plt = None
 
-def plot_ts(ts, title, fname):
-    rolmean = pd.Series.rolling(ts, window=12, center=False).mean()
-    rolstd = pd.Series.rolling(ts, window=12, center=False).std()
+
+def _pyplot():
+    global _plt
+    if _plt is None:
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        sns.set(style='ticks', context='talk')
+        _plt = plt
+    return _plt
+
+
+def rolling_mean_std(ts, window=12):
+    # accepts a pandas Series or a plain ndarray (e.g. a RaggedSeries view), returns the same kind
+    import pandas as pd
+    rolling = pd.Series(ts).rolling(window=window, center=False)
+    rolmean, rolstd = rolling.mean(), rolling.std()
+    if isinstance(ts, np.ndarray):
+        return rolmean.values, rolstd.values
+    return rolmean, rolstd
+
+
+def plot_ts(ts, title, fname, rolmean=None, rolstd=None):
+    plt = _pyplot()
+    if rolmean is None or rolstd is None:
+        rolmean, rolstd = rolling_mean_std(ts)
     orig = plt.plot(ts, color='blue', label='Original')
     mean = plt.plot(rolmean, linestyle='dashed', color='red', label='Rolling Mean')
     std = plt.plot(rolstd, linestyle='dotted', color='black', label='Rolling Std')
@@ -24,9 +42,11 @@ def plot_ts(ts, title, fname):
 def adf(ts, fname=None, disp=None):
     if fname:
         plot_ts(ts, title='Rolling Mean & Standard Deviation', fname=fname)
+    from statsmodels.tsa.stattools import adfuller
     # Calculate ADF factors
     adftest = adfuller(ts, autolag='AIC')
     if disp:
+        import pandas as pd
         adfoutput = pd.Series(adftest[0:4], index=['Test Statistic', 'p-value', '# of Lags Used',
                                                    'Number of Observations Used'])
         for key,value in adftest[4].items():
@@ -35,18 +55,25 @@ def adf(ts, fname=None, disp=None):
     return adftest
 
 
-def is_stationary(ts):
-    adftest = adf(ts)
+def stationary(adftest):
     return adftest[1] < 0.5 and any([v > adftest[0] for k, v in adftest[4].items()])
 
 
+def is_stationary(ts):
+    return stationary(adf(ts))
+
+
 def RMSE(predicted, actual):
+    if isinstance(predicted, np.ndarray) and isinstance(actual, np.ndarray):
+        return np.sqrt(np.nanmean((predicted - actual)**2))
     mse = (predicted - actual)**2
     rmse = np.sqrt(mse.sum()/mse.count())
     return rmse
 
 
 def differentiate(ts):
+    if isinstance(ts, np.ndarray):
+        return np.diff(ts)
     return ts.diff().dropna()
 
 
@@ -54,27 +81,33 @@ def log_transform(ts):
     return np.log(ts)
 
 
+def plot_acf_pacf(lag_acf, lag_pacf, n, fname):
+    plt = _pyplot()
+    #Plot ACF:
+    plt.subplot(121)
+    plt.plot(lag_acf)
+    plt.axhline(y=0, linestyle='--', color='gray')
+    plt.axhline(y=-1.96/np.sqrt(n), linestyle='--',color='gray')
+    plt.axhline(y=1.96/np.sqrt(n), linestyle='--',color='gray')
+    plt.title('Autocorrelation Function')
+    #Plot PACF:
+    plt.subplot(122)
+    plt.plot(lag_pacf)
+    plt.axhline(y=0, linestyle='--', color='gray')
+    plt.axhline(y=-1.96/np.sqrt(n), linestyle='--',color='gray')
+    plt.axhline(y=1.96/np.sqrt(n), linestyle='--',color='gray')
+    plt.title('Partial Autocorrelation Function')
+    plt.tight_layout()
+    plt.savefig(fname)
+    plt.close()
+
+
 def find_acf_pacf(ts, nlags=12, fname=None):
+    from statsmodels.tsa.stattools import acf, pacf
     lag_acf = acf(ts, nlags=nlags)
     lag_pacf = pacf(ts, nlags=nlags, method='ols')
     if fname:
-        #Plot ACF:
-        plt.subplot(121)
-        plt.plot(lag_acf)
-        plt.axhline(y=0, linestyle='--', color='gray')
-        plt.axhline(y=-1.96/np.sqrt(len(ts)), linestyle='--',color='gray')
-        plt.axhline(y=1.96/np.sqrt(len(ts)), linestyle='--',color='gray')
-        plt.title('Autocorrelation Function')
-        #Plot PACF:
-        plt.subplot(122)
-        plt.plot(lag_pacf)
-        plt.axhline(y=0, linestyle='--', color='gray')
-        plt.axhline(y=-1.96/np.sqrt(len(ts)), linestyle='--',color='gray')
-        plt.axhline(y=1.96/np.sqrt(len(ts)), linestyle='--',color='gray')
-        plt.title('Partial Autocorrelation Function')
-        plt.tight_layout()
-        plt.savefig(fname)
-        plt.close()
+        plot_acf_pacf(lag_acf, lag_pacf, len(ts), fname)
     return lag_acf, lag_pacf
 
 